@@ -1,16 +1,77 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
+import torch
 
 from PIL import Image
-from scipy.spatial.transform import Rotation
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset, Sampler, get_worker_info
 from torchvision import transforms
 
 import h5py
 
+from export_flat import FlatStore, load_index
+from hdf5_writer import completed_frames, decode_image, image_encoding, image_shape
+from image_cache import LRUCache, SharedImageStore
+from negative_samples import make_negative_sampler
+from poses import load_manifest
+
+# ImageNet statistics used by preprocess=True
+MEAN = [0.485, 0.456, 0.406]
+STD = [0.229, 0.224, 0.225]
+
 SYMSOL_I = {"tet", "cube", "icosa", "cone", "cyl"}
 SYMSOL_II = {"tetX", "cylO", "sphereX"}
 
 
+def normalize_batch(images, normalize=True):
+    # Turn a batch of uint8 images (B, H, W, 3), as returned with preprocess="batch",
+    # into float32 (B, 3, H, W) in one pass over the batch, on whatever device it is
+    # on. Gives exactly what preprocess=True (normalize=True) or preprocess=False
+    # (normalize=False) give per sample, since it runs the same operations as
+    # ToTensor and Normalize.
+    images = images.permute(0, 3, 1, 2).float().div(255)
+    if normalize:
+        mean = torch.as_tensor(MEAN, dtype=images.dtype, device=images.device)
+        std = torch.as_tensor(STD, dtype=images.dtype, device=images.device)
+        images = images.sub_(mean[:, None, None]).div_(std[:, None, None])
+    return images
+
+
+def verify_manifest(path, manifest):
+    # Check that every component of an hdf5 file was rendered from the given pose
+    # manifest (a path or the dict returned by poses.load_manifest): the stored
+    # angles must equal the manifest's matrices, and the pose digest recorded by
+    # the generator (if any) must match. Raises ValueError on a mismatch.
+    if isinstance(manifest, str):
+        manifest = load_manifest(manifest)
+
+    with h5py.File(path, "r") as f:
+        for component in f.keys():
+            g = f[component]
+            check_poses(f"{path}/{component}", g.attrs.get("pose_digest"), completed_frames(g), g["angles"], manifest)
+
+
+def verify_flat_manifest(flat_dir, name, manifest):
+    # verify_manifest for a file of a flat export (see export_flat.py)
+    if isinstance(manifest, str):
+        manifest = load_manifest(manifest)
+
+    for component, entry in load_index(flat_dir)["files"][name]["components"].items():
+        angles = np.load(f"{flat_dir}/{entry['angles']}", mmap_mode="r")
+        check_poses(f"{flat_dir}/{name}/{component}", entry["attrs"].get("pose_digest"), entry["n_frames"], angles, manifest)
+
+
+def check_poses(name, digest, n_frames, angles, manifest):
+    expected = manifest["matrices"].astype(np.float32)
+    if digest is not None and digest != manifest["digest"]:
+        raise ValueError(f"{name} was rendered from a different pose manifest")
+    if n_frames != len(expected):
+        raise ValueError(f"{name} holds {n_frames} of {len(expected)} frames")
+    if not np.array_equal(angles[:len(expected)], expected):
+        raise ValueError(f"{name} angles do not match the pose manifest")
+
+
 class BottleCapDataset(Dataset):
     # Adapted from: https://www.tensorflow.org/datasets/catalog/symmetric_solids.
     # Args:
@@ -18,7 +79,36 @@ class BottleCapDataset(Dataset):
     #   dataset: str, name of dataset (e.g. Arrow_cube_data.hdf5).
     #   subset: list of str, subset of shapes to use (e.g. ["Arrow", "Diamond"]).
     #   neg_samples: int, number of negative samples to use per image.
-    def __init__(self, data_dir, subset, neg_samples, preprocess=True, type="train"):
+    #   preprocess: True to return normalized float32 (3, H, W) images, False for
+    #     unnormalized ones, "batch" to return the raw uint8 (H, W, 3) images and
+    #     convert whole batches later with normalize_batch (4x less data through
+    #     the DataLoader workers' IPC, and the conversion can run on the GPU).
+    #   manifest: str, optional path to the pose manifest the files were rendered from;
+    #     every file is checked against it (see verify_manifest).
+    #   cache: None to read from the hdf5 files every time; "shm" to copy all images
+    #     once into shared memory (see image_cache.SharedImageStore) that every worker
+    #     maps zero-copy; "lru" to keep the most recently used samples in each
+    #     worker, for datasets that don't fit in memory.
+    #   cache_bytes: int, memory for the samples kept with cache="lru", per worker
+    #     (so num_workers times this in total). 256 MiB holds about 1300 samples of
+    #     256x256 images.
+    #   shm_dir: str, tmpfs directory for cache="shm".
+    #   backend: "hdf5" to read the {object}_cube_data.hdf5 files, or "flat" to
+    #     memory-map an export made with export_flat.py (data_dir is then the export
+    #     directory). The flat backend needs no cache.
+    #   negatives: how the negative rotations are drawn, one of
+    #     negative_samples.NEGATIVES or a NegativeSampler. With "deferred" the
+    #     rotations are returned as (1, 9) and negative_samples.append_negatives adds
+    #     the negatives after collation, e.g. on the GPU.
+    #   decode_threads: int, threads per process decoding images stored as PNG or
+    #     WebP blobs (see hdf5_writer.FrameWriter's encoding); PIL releases the GIL
+    #     while decoding.
+    #   view: "full" for the rendered frames, or "crop" for the square crops around
+    #     the object stored by a FrameWriter with crop_size (smaller, and the object
+    #     fills the frame).
+    def __init__(self, data_dir, subset, neg_samples, preprocess=True, type="train", manifest=None,
+                 cache=None, cache_bytes=256 * 2 ** 20, shm_dir="/dev/shm", backend="hdf5", negatives="scipy",
+                 decode_threads=4, view="full"):
         assert neg_samples > 0
 
         # Location of the h5 files
@@ -38,16 +128,57 @@ class BottleCapDataset(Dataset):
 
         self.components = ["Bottle", "Cap"]
         
-        # Number of images per component'
+        # Number of bottle components (probably 2--bottle and cap)
+        self.n_components = len(self.components)
 
-        with h5py.File(f"{self.data_dir}/{self.object_file_names[0]}", "r") as f:
-            self.n_images = len(f["Bottle"]['images'])
+        # Number of images of each (file, component); files may hold different
+        # numbers of images, e.g. when rendered with different settings
+        self.n_images = np.zeros((self.n_objects, self.n_components), dtype=np.int64)
+        shapes = set()
 
-            # Number of bottle components (probably 2--bottle and cap)
-            self.n_components = len(f.keys())
+        # Dataset the images are read from
+        if view not in ("full", "crop"):
+            raise ValueError(f"Unknown view {view!r}; expected 'full' or 'crop'")
+        self.image_key = "images" if view == "full" else "crops"
 
-        # Total number of images in the dataset
-        self.length = self.n_objects * self.n_components * self.n_images
+        self.backend = backend
+        if backend == "flat":
+            index = load_index(self.data_dir)
+            for i, name in enumerate(self.object_file_names):
+                entries = index["files"][name]["components"]
+                for j, c in enumerate(self.components):
+                    if self.image_key not in entries[c]:
+                        raise ValueError(f"{self.data_dir}/{name}/{c} has no {self.image_key}")
+                    self.n_images[i, j] = entries[c]["n_frames"]
+                    shapes.add(tuple(entries[c]["crops_shape" if view == "crop" else "image_shape"]))
+        elif backend == "hdf5":
+            for i, name in enumerate(self.object_file_names):
+                with h5py.File(f"{self.data_dir}/{name}", "r") as f:
+                    for j, c in enumerate(self.components):
+                        if self.image_key not in f[c]:
+                            raise ValueError(f"{self.data_dir}/{name}/{c} has no {self.image_key}; render it "
+                                             f"with a crop_size to use view='crop'")
+                        self.n_images[i, j] = completed_frames(f[c])
+                        shapes.add(image_shape(f[c], self.image_key))
+        else:
+            raise ValueError(f"Unknown backend {backend!r}; expected 'hdf5' or 'flat'")
+
+        if len(shapes) != 1:
+            raise ValueError(f"All files must hold images of the same shape; found {sorted(shapes)}")
+        self.image_shape = shapes.pop()
+
+        if manifest is not None:
+            manifest = load_manifest(manifest)
+            for name in self.object_file_names:
+                if backend == "flat":
+                    verify_flat_manifest(self.data_dir, name, manifest)
+                else:
+                    verify_manifest(f"{self.data_dir}/{name}", manifest)
+
+        # Index of the first image of each (file, component) group, in file-major
+        # order, and the total number of images in the dataset
+        self.offsets = np.concatenate([[0], np.cumsum(self.n_images.ravel())])
+        self.length = int(self.offsets[-1])
 
 
         # print("Length is: ", self.length)
@@ -56,12 +187,44 @@ class BottleCapDataset(Dataset):
         # print("n_images is: ", self.n_images)
 
         self.neg_samples = neg_samples
+        self.decode_threads = decode_threads
+        self._pool = None
+        self._pool_pid = None
+        self.negatives = make_negative_sampler(negatives)
+
+        self.cache = cache
+        self.store = None
+        self.lru = None
+        if backend == "flat":
+            if cache is not None:
+                raise ValueError("The flat backend is already memory-mapped; use cache=None")
+            # Images stay memory-mapped; the rotations are small enough to keep in memory
+            groups = [(name, c) for name in self.object_file_names for c in self.components]
+            self.store = FlatStore(self.data_dir, groups, index, key=self.image_key)
+            self.angles = [np.load(f"{self.data_dir}/{index['files'][name]['components'][c]['angles']}")
+                           for name, c in groups]
+        elif cache == "shm":
+            # Copy the images to shared memory once, here in the main process; the
+            # rotations are small enough to keep in memory
+            groups = [(f"{self.data_dir}/{name}", c) for name in self.object_file_names for c in self.components]
+            self.store = SharedImageStore(groups, shm_dir, key=self.image_key)
+            self.angles = []
+            for path, c in groups:
+                with h5py.File(path, "r") as f:
+                    self.angles.append(f[c]["angles"][:completed_frames(f[c])])
+        elif cache == "lru":
+            self.lru = LRUCache(cache_bytes)
+        elif cache is not None:
+            raise ValueError(f"Unknown cache mode {cache!r}; expected None, 'shm' or 'lru'")
 
-        if preprocess:
+        self.raw = preprocess == "batch"
+        if self.raw:
+            self.preprocess = torch.from_numpy
+        elif preprocess:
             self.preprocess = transforms.Compose(
                 [
                     transforms.ToTensor(),
-                    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+                    transforms.Normalize(MEAN, STD),
                 ]
             )
         else:
@@ -69,15 +232,16 @@ class BottleCapDataset(Dataset):
 
     
     def idx_to_local(self, idx):
-        l_file = self.length // self.n_objects
-        l_component = self.length // (self.n_objects * self.n_components)
+        # Binary search for the (file, component) group holding idx; works on
+        # single indices and on arrays of them
+        if np.any(np.asarray(idx) < 0) or np.any(np.asarray(idx) >= self.length):
+            raise IndexError(f"Index out of range for a dataset of {self.length} images")
+        group = np.searchsorted(self.offsets, idx, side="right") - 1
 
-        # Current file
-        file_idx = idx // l_file
-        # Component index
-        component_idx = (idx % l_file) // l_component
+        # Current file and component index
+        file_idx, component_idx = np.divmod(group, self.n_components)
 
-        image_idx = (idx % l_file) % l_component
+        image_idx = idx - self.offsets[group]
 
         return (file_idx, component_idx, image_idx)
 
@@ -86,10 +250,34 @@ class BottleCapDataset(Dataset):
     def __len__(self):
         return self.length
 
-    def __getitem__(self, idx):
+    def open(self):
         # If it hasn't been opened yet, open the dataset
         if self.datasets is None:
             self.datasets = [h5py.File(f"{self.data_dir}/{self.object_file_names[i]}", "r") for i in range(self.n_objects)]
+
+    def __getstate__(self):
+        # Open files and thread pools can't be sent to spawned workers; each worker
+        # opens its own
+        state = dict(self.__dict__)
+        state["datasets"] = None
+        state["_pool"] = None
+        state["_pool_pid"] = None
+        return state
+
+    def decode(self, blobs, out):
+        # Decode PNG/WebP blobs into out with a per-process thread pool (a pool
+        # inherited through fork has no threads)
+        if self._pool_pid != os.getpid():
+            self._pool = ThreadPoolExecutor(self.decode_threads) if self.decode_threads > 1 else None
+            self._pool_pid = os.getpid()
+
+        if self._pool is None or len(blobs) == 1:
+            for j, blob in enumerate(blobs):
+                decode_image(blob, out[j])
+        else:
+            list(self._pool.map(decode_image, blobs, out))
+
+    def __getitem__(self, idx):
         
         # Get the correct indices
         file_idx, component_idx, image_idx = self.idx_to_local(idx)
@@ -98,13 +286,304 @@ class BottleCapDataset(Dataset):
         # print("Image idx is: ", image_idx)
 
         # Get the image and rotation
-        img = self.datasets[file_idx][self.components[component_idx]]["images"][image_idx]
-        # print("Angles length is: ", self.datasets[file_idx][self.components[component_idx]]["angles"][0].shape)
-        R = self.datasets[file_idx][self.components[component_idx]]["angles"][image_idx]
+        img, R = self.read_one(file_idx, component_idx, image_idx)
 
         img = self.preprocess(img)
 
-        fake_Rs = Rotation.random(self.neg_samples).as_matrix()
+        if self.negatives is None:
+            return (img, R.reshape(1, 9).astype(np.float64))
+
+        fake_Rs = self.negatives.sample(1, self.neg_samples)[0]
         R_fake_Rs = np.concatenate([R[None], fake_Rs])
 
         return (img, R_fake_Rs.reshape(-1, 9))
+
+    def read_one(self, file_idx, component_idx, image_idx):
+        # Read one image and rotation, through the cache if there is one
+        if self.store is not None:
+            g = file_idx * self.n_components + component_idx
+            return np.array(self.store.images(g)[image_idx]), self.angles[g][image_idx]
+
+        if self.lru is not None:
+            key = (file_idx, component_idx, int(image_idx))
+            hit = self.lru.get(key)
+            if hit is not None:
+                return hit
+
+        imgs, Rs = self.read_hdf5(file_idx, component_idx, np.array([image_idx]))
+        img, R = imgs[0], Rs[0]
+
+        if self.lru is not None:
+            self.lru.put(key, (img, R))
+        return img, R
+
+    def read_group(self, file_idx, component_idx, image_idxs):
+        # Read several images and rotations of one (file, component), each index
+        # once and in increasing order, so read_hdf5 reads every run of
+        # consecutive indices with one slice.
+        unique, inverse = np.unique(image_idxs, return_inverse=True)
+
+        if self.store is not None:
+            g = file_idx * self.n_components + component_idx
+            return self.store.images(g)[unique][inverse], self.angles[g][unique][inverse]
+
+        if self.lru is not None:
+            # Only read the samples that aren't cached
+            imgs = np.empty((len(unique),) + tuple(self.image_shape), dtype=np.uint8)
+            Rs = np.empty((len(unique), 3, 3), dtype=np.float32)
+            missing = []
+            for j, i in enumerate(unique):
+                hit = self.lru.get((file_idx, component_idx, int(i)))
+                if hit is None:
+                    missing.append(j)
+                else:
+                    imgs[j], Rs[j] = hit
+            if missing:
+                missing = np.array(missing)
+                imgs[missing], Rs[missing] = self.read_hdf5(file_idx, component_idx, unique[missing])
+                for j in missing:
+                    # Copies, so a cached sample doesn't keep the whole batch alive
+                    self.lru.put((file_idx, component_idx, int(unique[j])), (imgs[j].copy(), Rs[j].copy()))
+            return imgs[inverse], Rs[inverse]
+
+        imgs, Rs = self.read_hdf5(file_idx, component_idx, unique)
+        return imgs[inverse], Rs[inverse]
+
+    def read_hdf5(self, file_idx, component_idx, image_idxs):
+        self.open()
+        group = self.datasets[file_idx][self.components[component_idx]]
+        images = group[self.image_key]
+        encoded = image_encoding(group, self.image_key) is not None
+        if isinstance(image_idxs, slice):
+            image_idxs = np.arange(image_idxs.start, image_idxs.stop)
+
+        # h5py's fancy indexing selects point by point and is orders of magnitude
+        # slower than slicing, so read each run of consecutive (sorted, unique)
+        # indices with one slice
+        imgs = np.empty((len(image_idxs),) + tuple(self.image_shape), dtype=np.uint8)
+        Rs = np.empty((len(image_idxs), 3, 3), dtype=np.float32)
+        blobs = []
+        breaks = np.nonzero(np.diff(image_idxs) != 1)[0] + 1
+        for run_start, run_stop in zip(np.r_[0, breaks], np.r_[breaks, len(image_idxs)]):
+            src = np.s_[image_idxs[run_start]:image_idxs[run_stop - 1] + 1]
+            dst = np.s_[run_start:run_stop]
+            if encoded:
+                blobs.extend(images[src])
+            else:
+                images.read_direct(imgs, src, dst)
+            group["angles"].read_direct(Rs, src, dst)
+
+        if encoded:
+            self.decode(blobs, imgs)
+        return imgs, Rs
+
+    def read_range(self, file_idx, component_idx, start, stop):
+        # Read the contiguous images [start, stop) of one (file, component) with one
+        # sequential slice read per dataset (used by BottleCapStream)
+        if self.store is not None:
+            g = file_idx * self.n_components + component_idx
+            return np.array(self.store.images(g)[start:stop]), self.angles[g][start:stop]
+        return self.read_hdf5(file_idx, component_idx, slice(start, stop))
+
+    def get_batch(self, indices):
+        # Batched version of __getitem__: returns the stacked images (B, 3, H, W)
+        # and rotations (B, neg_samples + 1, 9).
+        return self.to_samples(*self.read_batch(indices))
+
+    def read_batch(self, indices):
+        # Read the raw images (B, H, W, 3) and rotations (B, 3, 3) of a batch.
+        # Indices are grouped by (file, component) so each group costs one read.
+        indices = np.asarray(indices)
+        n = len(indices)
+        file_idx, component_idx, image_idx = self.idx_to_local(indices)
+
+        imgs = np.empty((n,) + tuple(self.image_shape), dtype=np.uint8)
+        Rs = np.empty((n, 3, 3), dtype=np.float32)
+        groups = file_idx * self.n_components + component_idx
+        for g in np.unique(groups):
+            sel = np.nonzero(groups == g)[0]
+            imgs[sel], Rs[sel] = self.read_group(g // self.n_components, g % self.n_components, image_idx[sel])
+        return imgs, Rs
+
+    def to_samples(self, imgs, Rs):
+        # Preprocess a stack of images (B, H, W, 3) and add negatives to their
+        # rotations (B, 3, 3), as get_batch returns them
+        return self.preprocess_batch(imgs), self.add_negatives(Rs)
+
+    def preprocess_batch(self, imgs):
+        if self.raw:
+            return torch.from_numpy(imgs)
+        return torch.stack([self.preprocess(im) for im in imgs])
+
+    def add_negatives(self, Rs):
+        # (B, neg_samples + 1, 9) rotations: each one followed by its negatives
+        n = len(Rs)
+        if self.negatives is None:
+            return torch.from_numpy(Rs.reshape(n, 1, 9).astype(np.float64))
+
+        fake_Rs = self.negatives.sample(n, self.neg_samples)
+        R_fake_Rs = np.concatenate([Rs[:, None], fake_Rs], axis=1)
+        return torch.from_numpy(R_fake_Rs.reshape(n, -1, 9))
+
+    def __getitems__(self, indices):
+        # Used by DataLoader to fetch a whole batch at once (see BottleCapBatchSampler);
+        # returns the per-sample tuples the default collate_fn expects.
+        img, R_fake_Rs = self.get_batch(indices)
+        return list(zip(img, R_fake_Rs))
+
+
+class BottleCapBatchSampler(Sampler):
+    # Batch sampler for BottleCapDataset. Each batch is sorted, which groups it by
+    # (file, component) and orders the reads within each group, so
+    # BottleCapDataset.__getitems__ issues one sequential read per group.
+    #   DataLoader(dataset, batch_sampler=BottleCapBatchSampler(dataset, 64), num_workers=4)
+    # Args:
+    #   dataset: BottleCapDataset (or anything with a length).
+    #   batch_size: int, number of samples per batch.
+    #   shuffle: bool, draw a new random permutation every epoch (see set_epoch).
+    #   drop_last: bool, drop the last incomplete batch.
+    #   seed: int, base seed of the permutation.
+    def __init__(self, dataset, batch_size, shuffle=True, drop_last=False, seed=0):
+        self.n = len(dataset)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        if self.shuffle:
+            order = np.random.default_rng(self.seed + self.epoch).permutation(self.n)
+        else:
+            order = np.arange(self.n)
+
+        for start in range(0, self.n, self.batch_size):
+            batch = order[start:start + self.batch_size]
+            if self.drop_last and len(batch) < self.batch_size:
+                break
+            yield np.sort(batch).tolist()
+
+    def __len__(self):
+        if self.drop_last:
+            return self.n // self.batch_size
+        return (self.n + self.batch_size - 1) // self.batch_size
+
+
+class BottleCapStream(IterableDataset):
+    # Streaming version of BottleCapDataset for multi-node training. The corpus is
+    # cut into units of up to chunk_size consecutive images of one (file,
+    # component); each epoch the units are shuffled with a seed shared by all
+    # ranks and dealt out round-robin to every (rank, DataLoader worker), so each
+    # one reads a disjoint slice of the corpus with whole, sequential reads. The
+    # samples are then shuffled locally through a buffer of buffer_size samples,
+    # which holds the raw uint8 images and rotations (about 200 MB per worker for
+    # 1024 samples of 256x256 images); preprocessing and negatives are applied to
+    # blocks of emit_size samples as they leave it.
+    # Yields the same (image, rotations) samples as BottleCapDataset.__getitem__.
+    #   stream = BottleCapStream(data_dir, subset, neg_samples, chunk_size=256)
+    #   loader = DataLoader(stream, batch_size=64, num_workers=4)
+    #   for epoch in range(n_epochs):
+    #       stream.set_epoch(epoch)
+    #       for img, R in loader: ...
+    # Call set_epoch before iterating. The epoch is kept in shared memory, so
+    # workers started earlier (persistent_workers=True) see it too. Ranks may get
+    # a different number of units (and samples) per epoch; the last unit of each
+    # group can be short.
+    # Args:
+    #   data_dir, subset, neg_samples: as for BottleCapDataset; other keyword
+    #     arguments (preprocess, type, backend, negatives, ...) are passed on to it.
+    #   chunk_size: int, number of consecutive images per unit.
+    #   buffer_size: int, number of samples in the shuffle buffer (0 or 1 to stream
+    #     the units in order).
+    #   emit_size: int, number of samples preprocessed and given negatives at once.
+    #   shuffle: bool, shuffle the units and samples.
+    #   seed: int, base seed; epoch e shuffles the units with seed + e.
+    #   rank, world_size: int, this process' rank; taken from torch.distributed when
+    #     it is initialized, else 0 and 1.
+    def __init__(self, data_dir, subset, neg_samples, chunk_size=256, buffer_size=1024, shuffle=True, seed=0,
+                 rank=None, world_size=None, emit_size=64, **kwargs):
+        self.dataset = BottleCapDataset(data_dir, subset, neg_samples, **kwargs)
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+        self.emit_size = emit_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        # Shared with the DataLoader workers, which get a copy of the stream. Without
+        # a lock, so it can be passed to workers of any start method
+        self._epoch = torch.multiprocessing.Value("q", 0, lock=False)
+
+        # (file, component, start, stop) units in corpus order
+        self.units = []
+        for g, n in enumerate(self.dataset.n_images.ravel()):
+            file_idx, component_idx = divmod(g, self.dataset.n_components)
+            for start in range(0, n, chunk_size):
+                self.units.append((file_idx, component_idx, start, min(start + chunk_size, n)))
+
+    @property
+    def epoch(self):
+        return self._epoch.value
+
+    def set_epoch(self, epoch):
+        self._epoch.value = epoch
+
+    def partition(self):
+        # This (rank, worker)'s units for the current epoch
+        rank, world_size = self.rank, self.world_size
+        if rank is None or world_size is None:
+            if torch.distributed.is_available() and torch.distributed.is_initialized():
+                rank, world_size = torch.distributed.get_rank(), torch.distributed.get_world_size()
+            else:
+                rank, world_size = 0, 1
+
+        info = get_worker_info()
+        worker, n_workers = (0, 1) if info is None else (info.id, info.num_workers)
+
+        order = np.arange(len(self.units))
+        if self.shuffle:
+            order = np.random.default_rng([self.seed, self.epoch]).permutation(order)
+
+        slot = rank * n_workers + worker
+        return [self.units[u] for u in order[slot::world_size * n_workers]], (rank, worker)
+
+    def __iter__(self):
+        units, (rank, worker) = self.partition()
+        rng = np.random.default_rng([self.seed, self.epoch, rank, worker])
+
+        # Raw (image, rotation) samples: in the shuffle buffer, and emitted but not
+        # yet turned into training samples
+        buffer = []
+        block = []
+        for file_idx, component_idx, start, stop in units:
+            imgs, Rs = self.dataset.read_range(file_idx, component_idx, start, stop)
+
+            for img, R in zip(imgs, Rs):
+                # Copies, so a buffered sample doesn't keep its whole unit alive
+                sample = (img.copy(), R.copy())
+                if not self.shuffle or self.buffer_size <= 1:
+                    block.append(sample)
+                elif len(buffer) < self.buffer_size:
+                    buffer.append(sample)
+                else:
+                    # Emit a random buffered sample and keep the new one in its place
+                    j = rng.integers(self.buffer_size)
+                    block.append(buffer[j])
+                    buffer[j] = sample
+
+                if len(block) == self.emit_size:
+                    yield from self.emit(block)
+                    block = []
+
+        rng.shuffle(buffer)
+        block.extend(buffer)
+        for start in range(0, len(block), self.emit_size):
+            yield from self.emit(block[start:start + self.emit_size])
+
+    def emit(self, block):
+        # Preprocess a list of raw samples and add their negatives
+        imgs, Rs = zip(*block)
+        return zip(*self.dataset.to_samples(np.stack(imgs), np.stack(Rs)))
@@ -0,0 +1,234 @@
+"""
+Benchmark BottleCapDataset on a synthetic dataset it generates itself, so it
+runs without the rendered FilesForKu data.
+
+Sweeps every combination of the given backends, DataLoader workers, batch
+sizes, negative sample counts, negative samplers and preprocessing modes, and
+reports for each:
+  - samples/sec through a DataLoader (persistent workers, after warm-up),
+  - per-stage time of one batch in the main process (read, preprocess,
+    negatives), to show where the time goes,
+  - peak resident memory (VmHWM) of the main process (over all configurations
+    run so far) and of each worker.
+
+Backends:
+  hdf5      read the hdf5 files (BottleCapDataset default)
+  shm       hdf5 copied to shared memory (cache="shm")
+  lru       hdf5 with a per-worker LRU cache (cache="lru")
+  flat      memory-mapped export (backend="flat", see export_flat.py)
+  stream    BottleCapStream, sequential chunk reads with a shuffle buffer
+
+Example:
+  python bench_dataloader.py --workers 0 2 4 --batch-size 64 --neg-samples 1 4096 --out bench_dataloader.json
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import torch
+from scipy.spatial.transform import Rotation
+from torch.utils.data import DataLoader
+
+from bc_dataloader import BottleCapBatchSampler, BottleCapDataset, BottleCapStream, normalize_batch
+from export_flat import export_dir
+from hdf5_writer import open_frame_writers
+from stage_timer import StageTimer, git_commit
+
+BACKENDS = ('hdf5', 'shm', 'lru', 'flat', 'stream')
+OBJECTS = ['BenchA', 'BenchB']
+
+
+def make_fixture(root, frames=512, size=256, seed=0):
+    """
+    Write {root}/train/{object}_cube_data.hdf5 files with smooth random images and
+    random rotations in the generator's layout, plus their flat export in
+    {root}_flat. Existing fixtures of the same size are reused.
+    """
+    train = os.path.join(root, 'train')
+    stamp = os.path.join(root, 'fixture.json')
+    config = {'frames': frames, 'size': size, 'seed': seed, 'objects': OBJECTS}
+    if os.path.exists(stamp):
+        with open(stamp) as f:
+            if json.load(f) == config:
+                return root, root + '_flat'
+    shutil.rmtree(root, ignore_errors=True)
+    os.makedirs(train)
+
+    rng = np.random.default_rng(seed)
+    for obj in OBJECTS:
+        f, writers = open_frame_writers(os.path.join(train, f'{obj}_cube_data.hdf5'), frames,
+                                        image_shape=(size, size, 3))
+        for writer in writers.values():
+            for _ in range(frames):
+                # Upsampled noise, so the images compress roughly like renders do
+                small = rng.integers(0, 256, (size // 16, size // 16, 3), dtype=np.uint8)
+                writer.append(np.kron(small, np.ones((16, 16, 1), dtype=np.uint8)),
+                              Rotation.random(random_state=rng).as_matrix())
+            writer.close()
+        f.close()
+
+    export_dir(train, os.path.join(root + '_flat', 'train'))
+    with open(stamp, 'w') as f:
+        json.dump(config, f)
+    return root, root + '_flat'
+
+
+def make_dataset(backend, roots, neg_samples, preprocess, negatives):
+    h5_root, flat_root = roots
+    kwargs = dict(preprocess=preprocess, negatives=negatives)
+    if backend == 'hdf5':
+        return BottleCapDataset(h5_root, OBJECTS, neg_samples, **kwargs)
+    if backend == 'shm':
+        return BottleCapDataset(h5_root, OBJECTS, neg_samples, cache='shm', **kwargs)
+    if backend == 'lru':
+        return BottleCapDataset(h5_root, OBJECTS, neg_samples, cache='lru', **kwargs)
+    if backend == 'flat':
+        return BottleCapDataset(flat_root, OBJECTS, neg_samples, backend='flat', **kwargs)
+    if backend == 'stream':
+        return BottleCapStream(h5_root, OBJECTS, neg_samples, chunk_size=64, buffer_size=256, **kwargs)
+    raise ValueError(f'Unknown backend {backend!r}; expected one of {BACKENDS}')
+
+
+def peak_rss(pid):
+    """
+    Peak resident set size (VmHWM) of a process in MiB, or None if unavailable.
+    It counts pages shared with other processes (e.g. memory maps) too.
+    """
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def profile_stages(dataset, batch_size, n_batches, seed=0):
+    """
+    Time the stages of BottleCapDataset.get_batch (read_batch, preprocess_batch
+    and add_negatives) separately in this process.
+    """
+    timer = StageTimer()
+    rng = np.random.default_rng(seed)
+    for _ in range(n_batches):
+        indices = np.sort(rng.choice(len(dataset), batch_size, replace=False))
+
+        with timer.stage('read'):
+            imgs, Rs = dataset.read_batch(indices)
+
+        with timer.stage('preprocess'):
+            img = dataset.preprocess_batch(imgs)
+            if dataset.raw:
+                # preprocess="batch" leaves normalizing to the consumer; time it too
+                normalize_batch(img)
+
+        if dataset.negatives is not None:
+            with timer.stage('negatives'):
+                dataset.add_negatives(Rs)
+    return timer.summary()
+
+
+def measure(dataset, workers, batch_size, n_batches, warmup):
+    """
+    Samples/sec through a DataLoader, and the peak RSS of the main process and
+    of each worker.
+    """
+    if isinstance(dataset, BottleCapStream):
+        loader = DataLoader(dataset, batch_size=batch_size, num_workers=workers, persistent_workers=workers > 0)
+    else:
+        sampler = BottleCapBatchSampler(dataset, batch_size, drop_last=True)
+        loader = DataLoader(dataset, batch_sampler=sampler, num_workers=workers, persistent_workers=workers > 0)
+
+    raw = (dataset.dataset if isinstance(dataset, BottleCapStream) else dataset).raw
+    n_samples = 0
+    elapsed = 0.0
+    worker_rss = []
+    done = 0
+    while done < warmup + n_batches:
+        it = iter(loader)
+        start = time.perf_counter()
+        for img, _ in it:
+            if raw:
+                img = normalize_batch(img)
+            done += 1
+            if done == warmup:
+                start = time.perf_counter()
+            elif done > warmup:
+                n_samples += len(img)
+            if done == warmup + n_batches:
+                break
+        if done > warmup:
+            elapsed += time.perf_counter() - start
+
+        # DataLoader keeps its worker processes private; read them while they run
+        for w in getattr(it, '_workers', []):
+            worker_rss.append(peak_rss(w.pid))
+        del it
+
+    return {
+        'samples_per_sec': n_samples / elapsed if elapsed > 0 else None,
+        'rss_main_mib': peak_rss(os.getpid()),
+        'rss_workers_mib': worker_rss[-workers:] if workers > 0 else [],
+    }
+
+
+def parse_preprocess(value):
+    return {'true': True, 'false': False, 'batch': 'batch'}[value]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument('--workers', nargs='+', type=int, default=[0, 2])
+    parser.add_argument('--batch-size', nargs='+', type=int, default=[64])
+    parser.add_argument('--neg-samples', nargs='+', type=int, default=[1, 4096])
+    parser.add_argument('--negatives', nargs='+', default=['scipy'],
+                        help='Negative samplers (see negative_samples.NEGATIVES)')
+    parser.add_argument('--preprocess', nargs='+', default=['true', 'batch'], choices=['true', 'false', 'batch'])
+    parser.add_argument('--batches', type=int, default=20, help='Timed batches per configuration')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--frames', type=int, default=512, help='Fixture images per object and component')
+    parser.add_argument('--fixture', default='/tmp/bc_bench_fixture')
+    parser.add_argument('--out', default='bench_dataloader.json', help='JSON report path')
+    args = parser.parse_args()
+
+    roots = make_fixture(args.fixture, args.frames)
+
+    results = []
+    for backend, workers, batch_size, neg_samples, negatives, preprocess in itertools.product(
+            args.backends, args.workers, args.batch_size, args.neg_samples, args.negatives, args.preprocess):
+        config = dict(backend=backend, workers=workers, batch_size=batch_size, neg_samples=neg_samples,
+                      negatives=negatives, preprocess=preprocess)
+        dataset = make_dataset(backend, roots, neg_samples, parse_preprocess(preprocess), negatives)
+
+        stages = profile_stages(dataset if backend != 'stream' else dataset.dataset, batch_size, 3)
+        result = dict(config, stages=stages, **measure(dataset, workers, batch_size, args.batches, args.warmup))
+        results.append(result)
+
+        stage_ms = '  '.join(f"{k} {v['mean'] * 1000:.1f}" for k, v in stages.items())
+        rss = ', '.join(f'{r:.0f}' for r in result['rss_workers_mib'] if r is not None)
+        print(f"{backend:6s} w={workers} bs={batch_size:<4d} neg={neg_samples:<5d} {negatives:10s} "
+              f"pre={preprocess:5s}  {result['samples_per_sec']:8.1f} samples/s  [{stage_ms}] ms/batch  "
+              f"rss main {result['rss_main_mib']:.0f} MiB workers [{rss}] MiB")
+
+        if backend == 'shm':
+            dataset.store.clear()
+
+    report = {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'torch': torch.__version__,
+        'fixture': {'frames': args.frames, 'objects': OBJECTS},
+        'results': results,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
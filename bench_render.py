@@ -0,0 +1,121 @@
+"""
+Benchmark the synthetic data generator on a small, fixed pose set.
+
+Renders --frames poses of one part through the same code path as
+generate_synthetic_data.py, after --warmup untimed frames on the same scene,
+and reports frames/sec and p50/p95 latency for each stage (scene setup,
+rotation, render, read-back, hdf5 write). The scene setup is timed over the
+parts of --setup-objects objects, as the generator moves from part to part.
+The report is also written as JSON so runs can be diffed between commits.
+
+Run with Blender:
+  blender --background --python bench_render.py -- --preset cycles-cpu-lowspp --out bench.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import bpy
+import h5py
+
+# Blender does not put the script's directory on the path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import generate_synthetic_data as gen
+from hdf5_writer import FrameWriter
+from poses import sample_from_spec
+from render_presets import PRESETS, describe_render_settings
+from stage_timer import StageTimer, git_commit
+
+
+def run(filepath, part, frames, warmup=2, seed=0, setup_parts=()):
+    """
+    Render `frames` fixed poses of one part and return the StageTimer, after
+    `warmup` untimed frames (shader compilation, BVH build, ...) on the same
+    prepared scene. The scene setup is timed for each (filepath, part) in
+    setup_parts, in order, and then for the benchmarked part.
+    """
+    spec = {'sampler': 'uniform-euler', 'count': warmup + frames, 'symmetry': 1, 'seed': seed}
+    poses, eulers = sample_from_spec(spec)
+    image_shape = (gen.resolution, gen.resolution, 3)
+
+    timer = StageTimer()
+    for setup_path, setup_part in setup_parts:
+        with timer.stage('scene_setup'):
+            gen.prepare_part(setup_path, setup_part)
+    with timer.stage('scene_setup'):
+        scene, obj, capture = gen.prepare_part(filepath, part)
+
+    with tempfile.TemporaryDirectory() as tmp, h5py.File(os.path.join(tmp, 'bench.hdf5'), 'w') as f:
+        if warmup > 0:
+            writer = FrameWriter(f.create_group('warmup'), warmup, image_shape=image_shape)
+            gen.render_poses(scene, obj, capture, poses[:warmup], eulers[:warmup], writer, StageTimer())
+
+        writer = FrameWriter(f.create_group(part), frames, image_shape=image_shape)
+        gen.render_poses(scene, obj, capture, poses[warmup:], eulers[warmup:], writer, timer)
+
+    return timer
+
+
+def main():
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--object', default=gen.objects[0])
+    parser.add_argument('--part', default='Bottle', choices=gen.types)
+    parser.add_argument('--frames', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--setup-objects', type=int, default=2,
+                        help='Also time the scene setup of the parts of this many objects, for its percentiles')
+    parser.add_argument('--preset', choices=sorted(PRESETS), help='Render quality preset (see render_presets.py)')
+    parser.add_argument('--engine', help="Render engine, e.g. CYCLES, BLENDER_EEVEE, BLENDER_WORKBENCH (default: the .blend's)")
+    parser.add_argument('--samples', type=int, help='Samples per pixel (default: the .blend\'s)')
+    parser.add_argument('--resolution', type=int, default=gen.resolution)
+    parser.add_argument('--capture', default=gen.capture_mode, choices=['memory', 'disk'])
+    parser.add_argument('--out', default='bench_render.json', help='JSON report path')
+    args = parser.parse_args(argv)
+
+    gen.render_preset = args.preset
+    gen.render_engine = args.engine
+    gen.render_samples = args.samples
+    gen.resolution = args.resolution
+    gen.capture_mode = args.capture
+
+    filepath = gen.part_files(args.object)[gen.types.index(args.part)]
+    setup_parts = [(path, part) for object in gen.objects[:args.setup_objects]
+                   for path, part in zip(gen.part_files(object), gen.types) if path != filepath]
+    timer = run(filepath, args.part, args.frames, warmup=args.warmup, setup_parts=setup_parts)
+
+    stages = timer.summary()
+    frame_time = sum(v['total'] for k, v in stages.items() if k != 'scene_setup')
+    scene = bpy.context.scene
+    report = {
+        'commit': git_commit(),
+        'blender': bpy.app.version_string,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {
+            'object': args.object,
+            'part': args.part,
+            'frames': args.frames,
+            'setup_parts': len(setup_parts) + 1,
+            'preset': args.preset,
+            'capture': args.capture,
+            'render': describe_render_settings(scene),
+        },
+        'frames_per_sec': args.frames / frame_time,
+        'stages': stages,
+    }
+
+    print(f"{report['frames_per_sec']:.2f} frames/s ({scene.render.engine}, {args.resolution}px)")
+    for name, v in stages.items():
+        print(f"  {name:12s} p50 {v['p50'] * 1000:9.2f} ms  p95 {v['p95'] * 1000:9.2f} ms  total {v['total']:.2f} s")
+
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
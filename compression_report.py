@@ -0,0 +1,131 @@
+"""
+Report how well the images of rendered hdf5 files compress and how fast they
+decode.
+
+For every component group of each file it prints the stored size of the images
+against their raw size and the read + decode throughput (frames/s, decoding
+blobs with --threads threads, as BottleCapDataset does). With --try, the first
+--frames images of each group are also rewritten in memory with each of the
+given storage options (hdf5 filters and PNG/WebP blobs, see hdf5_writer.py) to
+compare them before regenerating a dataset.
+
+Example:
+  python compression_report.py bc_ds_h5/train/*.hdf5 --try lzf gzip png webp blosc-lz4
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import h5py
+
+from hdf5_writer import (ENCODINGS, PLUGIN_FILTERS, FrameWriter, completed_frames, decode_image, image_compression,
+                         image_encoding, image_shape, read_frames)
+
+
+def stored_bytes(group, chunk=256):
+    """
+    Bytes the images of a group take in the file. Variable-length blobs live
+    outside the dataset's own storage, so they are summed up instead.
+    """
+    images = group['images']
+    if image_encoding(group) is None:
+        return images.id.get_storage_size()
+    n = completed_frames(group)
+    return sum(len(blob) for start in range(0, n, chunk) for blob in images[start:min(start + chunk, n)])
+
+
+def read_throughput(group, n, threads):
+    """
+    Frames/s reading and decoding the first n images of a group.
+    """
+    images = group['images']
+    out = np.empty((n,) + image_shape(group), dtype=np.uint8)
+
+    start = time.perf_counter()
+    if image_encoding(group) is None:
+        images.read_direct(out, np.s_[0:n], np.s_[0:n])
+    else:
+        blobs = list(images[0:n])
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(decode_image, blobs, out))
+    return n / (time.perf_counter() - start)
+
+
+def describe_group(group, n, threads):
+    shape = image_shape(group)
+    frames = completed_frames(group)
+    raw = frames * int(np.prod(shape))
+    stored = stored_bytes(group)
+    return {
+        'frames': frames,
+        'storage': image_encoding(group) or image_compression(group) or 'raw',
+        'raw_mb': raw / 2 ** 20,
+        'stored_mb': stored / 2 ** 20,
+        'ratio': raw / stored if stored else None,
+        'decode_fps': read_throughput(group, min(n, frames), threads),
+    }
+
+
+def try_option(imgs, option, threads):
+    """
+    Write imgs to an in-memory hdf5 file with one storage option (an encoding or
+    a compression filter) and measure the ratio and the write and read speeds.
+    """
+    n = len(imgs)
+    kwargs = {'encoding': option} if option in ENCODINGS else {'compression': option}
+    with h5py.File(f'try_{option}.hdf5', 'w', driver='core', backing_store=False) as f:
+        start = time.perf_counter()
+        writer = FrameWriter(f.create_group('g'), n, image_shape=imgs.shape[1:], **kwargs)
+        for img in imgs:
+            writer.append(img, np.eye(3))
+        writer.close()
+        write_fps = n / (time.perf_counter() - start)
+
+        g = f['g']
+        stored = stored_bytes(g)
+        decode_fps = read_throughput(g, n, threads)
+        assert np.array_equal(read_frames(g, 0, n), imgs), f'{option} is not lossless'
+    return {'ratio': imgs.nbytes / stored, 'write_fps': write_fps, 'decode_fps': decode_fps}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='+', help='hdf5 files written by generate_synthetic_data.py')
+    parser.add_argument('--try', dest='options', nargs='*', default=[],
+                        choices=['gzip', 'lzf', *PLUGIN_FILTERS, *ENCODINGS],
+                        help='Storage options to compare on the first --frames images')
+    parser.add_argument('--frames', type=int, default=64, help='Images per group to time and to try')
+    parser.add_argument('--threads', type=int, default=4, help='Decode threads')
+    parser.add_argument('--out', help='Also write the report as JSON')
+    args = parser.parse_args()
+
+    report = {}
+    for path in args.files:
+        with h5py.File(path, 'r') as f:
+            for component in f.keys():
+                g = f[component]
+                name = f'{path}/{component}'
+                info = describe_group(g, args.frames, args.threads)
+                print(f"{name}: {info['frames']} frames, {info['storage']}, {info['stored_mb']:.1f} of "
+                      f"{info['raw_mb']:.1f} MB ({info['ratio']:.1f}x), {info['decode_fps']:.0f} frames/s")
+
+                if args.options:
+                    imgs = read_frames(g, 0, min(args.frames, info['frames']))
+                    info['tried'] = {}
+                    for option in args.options:
+                        r = try_option(imgs, option, args.threads)
+                        info['tried'][option] = r
+                        print(f"  {option:10s} {r['ratio']:7.1f}x  write {r['write_fps']:7.0f} frames/s  "
+                              f"decode {r['decode_fps']:7.0f} frames/s")
+                report[name] = info
+
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
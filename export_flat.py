@@ -0,0 +1,185 @@
+"""
+Export {object}_cube_data.hdf5 files to a flat, memory-mappable layout that
+BottleCapDataset(..., backend="flat") reads with np.load(mmap_mode="r").
+
+Every (file, component) group becomes two .npy files, the images (N, H, W, 3)
+uint8 and the angles (N, 3, 3) float32 (plus the bboxes, crops and crop_boxes
+if the group has them), next to an index.json that lists them
+with their frame counts and the group's attributes (pose digest, pose spec,
+render settings). Only the completed frames of each group are exported. The
+split subdirectories (train, test, ...) of the source directory are mirrored:
+
+  bc_ds_h5/train/Arrow_cube_data.hdf5
+  -> bc_ds_flat/train/index.json
+     bc_ds_flat/train/Arrow_cube_data/Bottle_images.npy
+     bc_ds_flat/train/Arrow_cube_data/Bottle_angles.npy
+     ...
+
+Reading a memory map needs no file handles or library state, so it is safe in
+forked DataLoader workers, costs nothing at startup, and the OS page cache is
+shared by every worker and process reading the same files. Files whose source
+hasn't changed since the last export are skipped.
+
+Example:
+  python export_flat.py bc_ds_h5 bc_ds_flat
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+import h5py
+
+from hdf5_writer import completed_frames, image_shape, read_frames
+
+INDEX = 'index.json'
+
+
+def source_stamp(path):
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def json_attrs(attrs):
+    """
+    The attributes of an hdf5 group that can be stored as JSON.
+    """
+    out = {}
+    for key, value in attrs.items():
+        if isinstance(value, bytes):
+            value = value.decode()
+        elif isinstance(value, np.generic):
+            value = value.item()
+        elif isinstance(value, np.ndarray):
+            value = value.tolist()
+        if isinstance(value, (str, int, float, bool, list)):
+            out[key] = value
+    return out
+
+
+def export_file(h5_path, out_dir, chunk=256):
+    """
+    Export every component group of h5_path into out_dir/{file stem}/ and return
+    its index entry.
+    """
+    name = os.path.basename(h5_path)
+    stem = os.path.splitext(name)[0]
+    os.makedirs(os.path.join(out_dir, stem), exist_ok=True)
+
+    entry = {'source': source_stamp(h5_path), 'components': {}}
+    with h5py.File(h5_path, 'r') as f:
+        for component in f.keys():
+            g = f[component]
+            n = completed_frames(g)
+            keys = [key for key in ('images', 'angles', 'bboxes', 'crops', 'crop_boxes') if key in g]
+            paths = {key: f'{stem}/{component}_{key}.npy' for key in keys}
+
+            # Images stored as PNG/WebP blobs are decoded on the way
+            readers = {}
+            for key in keys:
+                if key in ('images', 'crops'):
+                    readers[key] = (np.uint8, image_shape(g, key),
+                                    lambda start, stop, key=key: read_frames(g, start, stop, key))
+                else:
+                    readers[key] = (g[key].dtype, g[key].shape[1:], lambda start, stop, key=key: g[key][start:stop])
+            for key, rel in paths.items():
+                dtype, shape, read = readers[key]
+                path = os.path.join(out_dir, rel)
+                tmp = f'{path}.tmp'
+                out = np.lib.format.open_memmap(tmp, mode='w+', dtype=dtype, shape=(n,) + tuple(shape))
+                for start in range(0, n, chunk):
+                    stop = min(start + chunk, n)
+                    out[start:stop] = read(start, stop)
+                out.flush()
+                del out
+                os.replace(tmp, path)
+
+            entry['components'][component] = dict(
+                n_frames=n,
+                image_shape=list(image_shape(g)),
+                **({'crops_shape': list(image_shape(g, 'crops'))} if 'crops' in g else {}),
+                attrs=json_attrs(g.attrs),
+                **paths,
+            )
+    return entry
+
+
+def load_index(flat_dir):
+    with open(os.path.join(flat_dir, INDEX)) as f:
+        return json.load(f)
+
+
+def save_index(flat_dir, index):
+    # Write atomically so readers never see a half-written index
+    path = os.path.join(flat_dir, INDEX)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(f'{path}.tmp', path)
+
+
+def export_dir(src_dir, out_dir, force=False):
+    """
+    Export every .hdf5 file in src_dir to out_dir and update out_dir/index.json.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    index_path = os.path.join(out_dir, INDEX)
+    index = load_index(out_dir) if os.path.exists(index_path) else {'files': {}}
+
+    for name in sorted(os.listdir(src_dir)):
+        if not name.endswith('.hdf5'):
+            continue
+        path = os.path.join(src_dir, name)
+        old = index['files'].get(name)
+        if not force and old is not None and old['source'] == source_stamp(path):
+            print(f'Skipping {path}: up to date')
+            continue
+
+        print(f'Exporting {path}')
+        index['files'][name] = export_file(path, out_dir)
+        save_index(out_dir, index)
+    return index
+
+
+class FlatStore:
+    """
+    Read-only memory maps of the images (or crops, with key='crops') of a list of
+    (file name, component) groups of a flat export. Maps are opened lazily in
+    each process, so the store can be pickled to DataLoader workers.
+    """
+
+    def __init__(self, flat_dir, groups, index=None, key='images'):
+        self.flat_dir = flat_dir
+        index = index or load_index(flat_dir)
+        self.paths = [os.path.join(flat_dir, index['files'][name]['components'][c][key]) for name, c in groups]
+        self.arrays = None
+
+    def images(self, i):
+        if self.arrays is None:
+            self.arrays = [np.load(path, mmap_mode='r') for path in self.paths]
+        return self.arrays[i]
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['arrays'] = None
+        return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('src', help='Directory of .hdf5 files, or of split subdirectories (train, test, ...)')
+    parser.add_argument('out', help='Output directory')
+    parser.add_argument('--force', action='store_true', help='Re-export files that are up to date')
+    args = parser.parse_args()
+
+    splits = [d for d in sorted(os.listdir(args.src)) if os.path.isdir(os.path.join(args.src, d))]
+    if not splits or any(name.endswith('.hdf5') for name in os.listdir(args.src)):
+        export_dir(args.src, args.out, args.force)
+    for split in splits:
+        export_dir(os.path.join(args.src, split), os.path.join(args.out, split), args.force)
+
+    print('Done.')
+
+
+if __name__ == '__main__':
+    main()
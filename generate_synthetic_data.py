@@ -1,17 +1,29 @@
 ## Import all relevant libraries
+import argparse
+import json
+import sys
+import time
 import bpy
 import numpy as np
-import math as m
 import random
 import os
-from PIL import Image
 
 import matplotlib.pyplot as plt
 
-from scipy.spatial.transform import Rotation as R
-
 import h5py
 
+# Blender does not put the script's directory on the path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from hdf5_writer import ENCODINGS, PLUGIN_FILTERS, FrameWriter, open_frame_writers
+from render_capture import RenderCapture
+from render_presets import PRESETS, apply_preset, describe_render_settings, engine_name, set_samples
+from stage_timer import StageTimer
+from tiled_render import TiledRender
+from quaternions import from_euler
+from poses import load_manifest, manifest_digest, pose_eulers, sample_from_spec
+from synthetic_settings import SETTINGS, setting_spec
+
 def load_materials(material_dir):
   """
   Load materials from a directory. We assume that the directory contains .blend
@@ -141,12 +153,8 @@ def get_quaternion_from_euler(roll, pitch, yaw):
   Output
     :return qx, qy, qz, qw: The orientation in quaternion [x,y,z,w] format
   """
-  qx = np.sin(roll/2) * np.cos(pitch/2) * np.cos(yaw/2) - np.cos(roll/2) * np.sin(pitch/2) * np.sin(yaw/2)
-  qy = np.cos(roll/2) * np.sin(pitch/2) * np.cos(yaw/2) + np.sin(roll/2) * np.cos(pitch/2) * np.sin(yaw/2)
-  qz = np.cos(roll/2) * np.cos(pitch/2) * np.sin(yaw/2) - np.sin(roll/2) * np.sin(pitch/2) * np.cos(yaw/2)
-  qw = np.cos(roll/2) * np.cos(pitch/2) * np.cos(yaw/2) + np.sin(roll/2) * np.sin(pitch/2) * np.sin(yaw/2)
- 
-  return np.array([qx, qy, qz, qw])
+  # from_euler is scalar-first
+  return from_euler(roll, pitch, yaw)[..., [1, 2, 3, 0]]
 
 def set_scene(filepath):
     bpy.ops.wm.open_mainfile(filepath=filepath)
@@ -155,6 +163,9 @@ def set_scene(filepath):
 
     # Add a camera to the scene
     camera_data = bpy.data.cameras.new("Camera")
+    if camera_ortho_scale is not None:
+        camera_data.type = 'ORTHO'
+        camera_data.ortho_scale = camera_ortho_scale
     camera_object = bpy.data.objects.new(name="Camera", object_data=camera_data)
     scene = bpy.context.scene
     scene.collection.objects.link(camera_object)
@@ -217,9 +228,26 @@ def set_scene(filepath):
     scene.collection.objects.link(light_object)
     light_object.location = (0, 0, 1)
 
+    apply_render_settings(scene)
 
     return scene, axis, light_object
 
+
+def apply_render_settings(scene):
+    """
+    Apply render_preset (see render_presets.py), then the render_engine and
+    render_samples overrides; None keeps whatever the .blend file carries.
+    """
+    if render_preset is not None:
+        apply_preset(scene, render_preset)
+
+    if render_engine is not None:
+        scene.render.engine = engine_name(render_engine)
+
+    if render_samples is not None:
+        set_samples(scene, render_samples)
+
+
 def change_color(color):
     bpy.data.materials["Material_3"].node_tree.nodes["Group"].inputs[0].default_value = colors[0]
     #bpy.ops.wm.save_as_mainfile(filepath="/home/tkaminsky/Desktop/bingham/bingham_vis/test.blend")
@@ -234,168 +262,332 @@ def change_color(color):
     # bpy.data.materials["Red"].specular_intensity = .5
 setting = "Full"
 
+# HDF5 output: frames are buffered and written write_batch_size at a time;
+# compression may be None, 'gzip', 'lzf' or, with hdf5plugin installed,
+# 'blosc-lz4', 'blosc-zstd' or 'lz4'. image_encoding 'png' or 'webp' stores each
+# frame as a lossless compressed blob instead, which suits the mostly black
+# frames best (compression_report.py compares the options on existing files)
+write_batch_size = 64
+compression = None
+image_encoding = None
+
+# Every frame's foreground bounding box is stored in "bboxes". With crop_size,
+# a square crop around it (crop_margin of its size added on each side) is also
+# stored, resized to crop_size x crop_size, in "crops"
+# (BottleCapDataset(..., view="crop") reads them)
+crop_size = None
+crop_margin = 0.1
+
+# 'disk' writes each frame to a per-process PNG and reads it back; 'memory' reads
+# the pixels from a compositor Viewer node without touching disk, which needs a
+# Blender build that runs the compositor in background renders (RenderCapture
+# checks one probe frame against the PNG and raises otherwise)
+capture_mode = 'disk'
+
+# Width and height of the rendered frames
+resolution = 256
+
+# Named render preset (see render_presets.py), e.g. 'cycles-cpu-lowspp'. None
+# keeps the settings of each .blend file. render_engine (e.g. 'CYCLES') and
+# render_samples override the preset.
+render_preset = None
+render_engine = None
+render_samples = None
+
+# (rows, cols) to render that many poses per frame as a grid of instanced
+# copies (see tiled_render.py), or None to render one pose per frame. Needs the
+# orthographic camera (camera_ortho_scale). Tiles must match single-object
+# frames to within tile_tolerance mean intensity levels, which takes a
+# Workbench preset: with Cycles or EEVEE the copies light each other.
+tile_grid = None
+tile_tolerance = 2.0
+
+# View width (in scene units) of an orthographic camera, or None for the 50 mm
+# perspective camera. 0.18 frames the part as the perspective camera does.
+camera_ortho_scale = None
+
+# Build the scene (materials, camera, light) once and only swap the part mesh
+# per file; False reopens and rebuilds the scene for every part
+scene_cache = True
+
+# Reopen existing output files and continue after their completed frames
+# instead of overwriting them
+resume = False
+
+types = ['Bottle', 'Cap']
+
+
+def load_setting(name, seed=None):
+  """
+  Set the module-level dataset configuration (see synthetic_settings.py) and
+  sample a fresh pose set for it.
+  """
+  global setting, dir, objects, randomize_color, randomize_light
 
-randomize_color = True
-randomize_light = True
-
-if setting == "Default":
-  dir = "FilesForKu/"
-  objects = ['Arrow_cube', 'Circle_cube', 'Cross_cube', 'Diamond_cube', 'Hexagon_cube', 'Key_cube', 'Line_cube', 'Pentagon_cube', 'U_cube']
-  #objects = ['Line_cube', 'Pentagon_cube', 'U_cube']
-  MIN = -m.pi / 3
-  MAX = m.pi / 3
-  STEP = m.pi / 18
-
-  # Randomly sample H orientations
-  H = 500
-  x_rots = np.random.uniform(MIN, MAX, H)
-  y_rots = np.random.uniform(MIN, MAX, H)
-  z_rots = np.random.uniform(0, 2 * m.pi, H)
-
-  # Convert to scipy rotations
-  sample = np.zeros((H, 3, 3))
-  for i in range(H):
-      sample[i] = R.from_euler('XYZ', [x_rots[i], y_rots[i], z_rots[i]]).as_matrix()
-
-elif setting == "Simple":
-  dir = "FilesForKu/"
-  objects = ['Cross_cube']
-  #objects = ['Line_cube', 'Pentagon_cube', 'U_cube']
-  MIN = -m.pi / 3
-  MAX = m.pi / 3
-  STEP = m.pi / 18
-
-  # Randomly sample H orientations
-  H = 500
-  x_rots = np.random.uniform(MIN, MAX, H)
-  y_rots = np.random.uniform(MIN, MAX, H)
-  z_rots = np.random.uniform(0, 2 * m.pi, H)
-
-  # Convert to scipy rotations
-  sample = np.zeros((4 * H, 3, 3))
-  for i in range(H):
-      for j in range(4):
-        # Rotate by multiples of 90 degrees
-        sample[4 * i + j] = R.from_euler('XYZ', [x_rots[i], y_rots[i], z_rots[i] + j * m.pi / 2]).as_matrix()
-        #sample[i] = R.from_euler('xyz', [x_rots[i], y_rots[i], z_rots[i]]).as_matrix()
-
-elif setting == "Full":
-  dir = "FilesForKu/"
-  objects = ['Arrow_cube', 'Circle_cube', 'Cross_cube', 'Diamond_cube', 'Hexagon_cube', 'Key_cube', 'Line_cube', 'Pentagon_cube', 'U_cube']
-  MIN = -m.pi / 3
-  MAX = m.pi / 3
-  STEP = m.pi / 18
-
-  # Randomly sample H orientations
-  H = 500
-  x_rots = np.random.uniform(MIN, MAX, H)
-  y_rots = np.random.uniform(MIN, MAX, H)
-  z_rots = np.random.uniform(0, 2 * m.pi, H)
-
-  # Convert to scipy rotations
-  sample = np.zeros((4 * H, 3, 3))
-  for i in range(H):
-      for j in range(4):
-        # Rotate by multiples of 90 degrees
-        sample[4 * i + j] = R.from_euler('XYZ', [x_rots[i], y_rots[i], z_rots[i] + j * m.pi / 2]).as_matrix()
-        #sample[i] = R.from_euler('xyz', [x_rots[i], y_rots[i], z_rots[i]]).as_matrix()
-  
-  randomize_color = False
-  randomize_light = False
-   
+  cfg = SETTINGS[name]
+  setting = name
+  dir = cfg['dir']
+  objects = cfg['objects']
+  randomize_color = cfg['randomize_color']
+  randomize_light = cfg['randomize_light']
+  spec = setting_spec(name, seed=seed)
+  set_sample(sample_from_spec(spec)[0], spec)
 
-def generate_random_data(object, name='bc_data'):
-  files = [f'{dir}{object}_bottle.blend', f'{dir}{object}_cap.blend']
-  types = ['Bottle', 'Cap']
 
+def set_sample(poses, spec=None):
+  """
+  Set the poses to render, along with the Euler angles the render loop needs
+  and the digest recorded with the rendered data.
+  """
+  global sample, eulers, pose_spec, pose_digest
+
+  sample = poses
+  eulers = pose_eulers(poses)
+  pose_spec = spec
+  pose_digest = manifest_digest(poses)
 
 
-  # Create a new hdf5 file
-  f = h5py.File(f'{object}_data.hdf5', 'w')
-  g_cap = f.create_group('Cap')
-  g_bottle = f.create_group('Bottle')
+def tag_group(group):
+  """
+  Record which pose set a group was rendered from.
+  """
+  group.attrs['pose_digest'] = pose_digest
+  group.attrs['pose_spec'] = json.dumps(pose_spec)
 
-  # Create a dataset of images and a dataset of orientations in each group
-  dset_cap = g_cap.create_dataset('images', (0, 256, 256, 3), maxshape=(None, 256, 256, 3), dtype='uint8')
-  dset_bottle = g_bottle.create_dataset('images', (0, 256, 256, 3), maxshape=(None, 256, 256, 3), dtype='uint8')
 
-  dset_cap_angles = g_cap.create_dataset('angles', (0, 3, 3), maxshape=(None, 3, 3), dtype='float32')
-  dset_bottle_angles = g_bottle.create_dataset('angles', (0, 3, 3), maxshape=(None, 3, 3), dtype='float32')
+load_setting(setting)
 
-  # if not os.path.exists(f'{name}/{object}'):
-  #         os.makedirs(f'{name}/{object}')
-  #         os.makedirs(f'{name}/{object}/Bottle')
-  #         os.makedirs(f'{name}/{object}/Cap')
+
+def part_files(object):
+  return [f'{dir}{object}_bottle.blend', f'{dir}{object}_cap.blend']
+
+
+def set_lighting(light_object):
+  """
+  Place the light and make the world background black.
+  """
+  light_object.location = (0,0,.5)
+  light_object.data.energy = 50
+
+  # Make the background black
+  world = bpy.data.worlds['World']
+  world.use_nodes = True
+  bg_node = world.node_tree.nodes['Background']
+  bg_node.inputs[0].default_value[:3] = (0, 0, 0)
+
+
+class SceneTemplate:
+  """
+  A scene that is set up once (materials, camera rig, light, background and
+  render capture) and reused for every part. Switching parts only swaps the part
+  object, appended from the part's .blend file, into the live scene; everything
+  else in the template comes from the first file it was built from.
+  """
+  def __init__(self, filepath, part):
+    self.scene, self.axis, self.light_object = set_scene(filepath)
+    set_lighting(self.light_object)
+
+    self.part = self.scene.objects[part]
+    self.material = bpy.data.materials['Material_3']
+    self.capture = RenderCapture(self.scene, resolution, resolution, mode=capture_mode)
+
+  def swap_part(self, filepath, part):
+    # Remove the current part and its mesh
+    mesh = self.part.data
+    bpy.data.objects.remove(self.part, do_unlink=True)
+    if mesh.users == 0:
+      bpy.data.meshes.remove(mesh)
+
+    # Append only the part object from its file and give it the shared material
+    with bpy.data.libraries.load(filepath, link=False) as (data_from, data_to):
+      data_to.objects = [part]
+    self.part = data_to.objects[0]
+    self.scene.collection.objects.link(self.part)
+
+    self.part.data.materials.clear()
+    self.part.data.materials.append(self.material)
+
+
+template = None
+
+
+def prepare_part(filepath, part):
+  """
+  Get the scene, part object and render capture for one part file, either from
+  the shared SceneTemplate or (scene_cache = False) by reloading the whole scene.
+  """
+  global template
+
+  if not scene_cache:
+    scene, axis, light_object = set_scene(filepath)
+    set_lighting(light_object)
+    return scene, scene.objects[part], RenderCapture(scene, resolution, resolution, mode=capture_mode)
+
+  # Blender can't append from the file that is currently open, so that one
+  # gets a fresh template
+  if template is None or os.path.abspath(filepath) == os.path.abspath(bpy.data.filepath):
+    template = SceneTemplate(filepath, part)
+  else:
+    template.swap_part(filepath, part)
+
+  return template.scene, template.part, template.capture
+
+
+def render_tiled(scene, obj, capture, poses, poses_euler, writer, timer):
+  """
+  Render poses tile_grid[0] * tile_grid[1] at a time with a TiledRender, after
+  checking that the tiles match the single-object frames from capture.
+  """
+  tiled = TiledRender(scene, obj, *tile_grid, tile=resolution, mode=capture_mode)
+  with timer.stage('framing_check'):
+    diffs = tiled.check_framing(capture, poses_euler, tolerance=tile_tolerance)
+  print(f'Tiled framing check: max mean difference {max(diffs):.2f} levels')
+
+  max_n = len(poses)
+  for s in range(0, max_n, tiled.k):
+      print(f'{s}/{max_n}')
+      n = min(tiled.k, max_n - s)
+
+      with timer.stage('rotate'):
+        tiled.set_poses(poses_euler[s:s + n])
+
+      with timer.stage('render'):
+        tiled.capture.render_frame()
+      with timer.stage('readback'):
+        tiles = tiled.read(n)
+
+      # Add the images to the dataset
+      with timer.stage('write'):
+        for j in range(n):
+          writer.append(tiles[j], poses[s + j])
+
+  tiled.restore()
+
+
+def render_part(filepath, part, poses, poses_euler, writer, timer=None):
+  """
+  Render every pose in poses for one part (e.g. "Bottle") and append the frames
+  to writer. poses_euler holds the matching 'xyz' Euler angles. Per-stage times
+  are collected in timer (a StageTimer), if given.
+  """
+  timer = timer or StageTimer()
+
+  # Set the scene
+  with timer.stage('scene_setup'):
+    scene, obj_now, capture = prepare_part(filepath, part)
+
+  t_render = render_poses(scene, obj_now, capture, poses, poses_euler, writer, timer)
+  print(f'{os.path.basename(filepath)}: setup {timer.times["scene_setup"][-1]:.2f}s, '
+        f'render {t_render:.2f}s ({len(poses) / max(t_render, 1e-9):.2f} frames/s)')
+
+
+def render_poses(scene, obj_now, capture, poses, poses_euler, writer, timer=None):
+  """
+  Render poses of the part obj_now in a scene from prepare_part, append the
+  frames to writer and close it. Returns the time taken in seconds.
+  """
+  timer = timer or StageTimer()
+
+  # Record the quality the frames are rendered at
+  writer.group.attrs['render_preset'] = render_preset or ''
+  writer.group.attrs['render_settings'] = json.dumps(describe_render_settings(scene))
+  t_start = time.perf_counter()
+
+  max_n = len(poses)
+
+  if tile_grid is not None:
+    render_tiled(scene, obj_now, capture, poses, poses_euler, writer, timer)
+  else:
+    for s in range(len(poses)):
+        # light_pos = (np.random.rand(2) - 0.5) 
+        # # Change the light position to a random position
+        # light_object.location = (light_pos[0], light_pos[1], .5)
+        # # Change energy 
+        # light_object.data.energy = np.random.uniform(energy_bounds[0], energy_bounds[1])
+        #light_object.data.energy = 50
+
+        # Randomize the color
+        #change_color(random.choice(colors))
+
+        if s % 10 == 0:
+            print(f'{s}/{max_n}')
+
+        with timer.stage('rotate'):
+          obj_now.rotation_euler = poses_euler[s]
+
+        with timer.stage('render'):
+          capture.render_frame()
+        with timer.stage('readback'):
+          img = capture.read()
+
+        # Add the image to the dataset
+        with timer.stage('write'):
+          writer.append(img, poses[s])
+
+  with timer.stage('write'):
+    writer.close()
+
+  return time.perf_counter() - t_start
+
+
+def continue_part(filepath, part, poses, poses_euler, writer):
+  """
+  Render the poses writer doesn't hold yet. With a fresh writer that is all of
+  them; a resumed writer skips its completed frames, and when poses extends the
+  set the frames were rendered from, only the new poses are rendered.
+  """
+  writer.check_poses(poses)
+  done = writer.n_completed
+
+  if done == len(poses):
+    print(f'{os.path.basename(filepath)}: all {done} frames already rendered')
+    writer.close()
+    return
+  if done > 0:
+    print(f'{os.path.basename(filepath)}: resuming at frame {done}/{len(poses)}')
+
+  tag_group(writer.group)
+  render_part(filepath, part, poses[done:], poses_euler[done:], writer)
+
+
+def generate_random_data(object, name='bc_data'):
+  files = part_files(object)
+
+  # Create a new hdf5 file with preallocated, chunked datasets for each type
+  # (or reopen the existing one when resuming)
+  f, writers = open_frame_writers(f'{object}_data.hdf5', len(sample), types=types, resume=resume,
+                                  batch_size=write_batch_size, compression=compression,
+                                  encoding=image_encoding, crop_size=crop_size, crop_margin=crop_margin,
+                                  image_shape=(resolution, resolution, 3))
 
   for i in range(len(files)):
-      # Set the scene
-      scene, axis, light_object = set_scene(files[i])
-      energy_bounds = [50, 150]
-      light_object.location = (0,0,.5)
-      light_object.data.energy = 50
-
-      # Make the background black
-      world = bpy.data.worlds['World']
-      world.use_nodes = True
-      bg_node = world.node_tree.nodes['Background']
-      bg_node.inputs[0].default_value[:3] = (0, 0, 0)
-
-      # Get the object
-      obj_now = scene.objects[types[i]]
-
-      max_n = len(sample)
-
-      for s in range(len(sample)):
-          # light_pos = (np.random.rand(2) - 0.5) 
-          # # Change the light position to a random position
-          # light_object.location = (light_pos[0], light_pos[1], .5)
-          # # Change energy 
-          # light_object.data.energy = np.random.uniform(energy_bounds[0], energy_bounds[1])
-          #light_object.data.energy = 50
-
-          # Randomize the color
-          #change_color(random.choice(colors))
-
-          if s % 10 == 0:
-              print(f'{s}/{max_n}')
-
-          x, y, z = R.from_matrix(sample[s]).as_euler('xyz')
-          #x, y, z = x_rots[s], y_rots[s], z_rots[s]
-          obj_now.rotation_euler = (x, y, z)
-          render = scene.render
-          render.use_overwrite = False
-          render.use_file_extension = True
-
-          #save_name = f"{name}/{object}/{types[i]}/{'{:08d}'.format(s)}.png"
-          save_name = "test.png"
-
-          render.resolution_x = 256
-          render.resolution_y = 256
-          render.resolution_percentage = 100
-          render.filepath = save_name
-
-          bpy.ops.render.render(write_still=True)
-
-          # Load the image as a PIL image
-          img_pil = Image.open(save_name)
-          img_pil = img_pil.resize((256, 256))
-          img_pil = img_pil.convert('RGB')
-          img = np.array(img_pil)
-
-
-          # Add the image to the dataset
-          if types[i] == 'Cap':
-              dset_cap.resize(dset_cap.shape[0] + 1, axis=0)
-              dset_cap[-1:] = img
-              dset_cap_angles.resize(dset_cap_angles.shape[0] + 1, axis=0)
-              dset_cap_angles[-1:] = sample[s]
-          else:
-              dset_bottle.resize(dset_bottle.shape[0] + 1, axis=0)
-              # Print the shape of the dataset
-
-              dset_bottle[-1:] = img
-              dset_bottle_angles.resize(dset_bottle_angles.shape[0] + 1, axis=0)
-              dset_bottle_angles[-1:] = sample[s]
+      continue_part(files[i], types[i], sample, eulers, writers[types[i]])
+
+  f.close()
+
+
+def generate_shard(object, part, start, stop, filename):
+  """
+  Render poses sample[start:stop] of one part into a shard file holding a single
+  group named after the part. render_sharded.py merges the shards back into
+  {object}_data.hdf5.
+  """
+  if resume and os.path.exists(filename):
+    f = h5py.File(filename, 'a')
+    g = f[part]
+  else:
+    f = h5py.File(filename, 'w')
+    g = f.create_group(part)
+  g.attrs['object'] = object
+  g.attrs['start'] = start
+  g.attrs['stop'] = stop
+
+  writer = FrameWriter(g, stop - start, batch_size=write_batch_size, compression=compression,
+                       encoding=image_encoding, crop_size=crop_size, crop_margin=crop_margin,
+                       image_shape=(resolution, resolution, 3), resume=resume)
+  continue_part(part_files(object)[types.index(part)], part, sample[start:stop], eulers[start:stop], writer)
+
+  f.close()
 
 
 # def generate_data(object, randomize_color=False):
@@ -468,10 +660,73 @@ def generate_random_data(object, name='bc_data'):
 #         np.save(f'bc_data/{object}/{types[i]}/angles.npy', gt_angles)
 
 
-object_list = objects
-
-for obj_atm in object_list:
-    print(f"Generating data for {obj_atm}")
-    generate_random_data(obj_atm, name="bc_data_mat")
-
-print("Done.")
\ No newline at end of file
+def parse_args(argv):
+  # Blender passes everything after '--' through to the script
+  argv = argv[argv.index('--') + 1:] if '--' in argv else []
+
+  parser = argparse.ArgumentParser(description='Render the synthetic bottle/cap dataset.')
+  parser.add_argument('--setting', default=setting, choices=sorted(SETTINGS))
+  parser.add_argument('--seed', type=int, help='Seed for the pose sample')
+  parser.add_argument('--spec', help='JSON pose spec (see poses.py) to sample the poses from')
+  parser.add_argument('--manifest', help='Pose manifest (.npz) with the exact poses to render')
+  parser.add_argument('--poses', help='.npy file of (N, 3, 3) rotations to render instead of a fresh sample')
+  parser.add_argument('--object', help='Render a single shard for this object (worker mode)')
+  parser.add_argument('--part', choices=types)
+  parser.add_argument('--start', type=int)
+  parser.add_argument('--stop', type=int)
+  parser.add_argument('--out', help='Shard file to write in worker mode')
+  parser.add_argument('--preset', choices=sorted(PRESETS), help='Render quality preset')
+  parser.add_argument('--tile-grid', help='Render ROWSxCOLS poses per frame, e.g. 3x3 (needs --ortho-scale)')
+  parser.add_argument('--ortho-scale', type=float, help='Use an orthographic camera this wide, e.g. 0.18')
+  parser.add_argument('--compression', choices=['gzip', 'lzf', *PLUGIN_FILTERS], help='hdf5 filter for the output')
+  parser.add_argument('--encoding', choices=ENCODINGS, help='Store frames as lossless PNG/WebP blobs')
+  parser.add_argument('--crop-size', type=int, help='Also store object crops resized to this size')
+  parser.add_argument('--resume', action='store_true',
+                      help='Continue existing output files instead of overwriting them')
+  parser.add_argument('--no-scene-cache', action='store_true',
+                      help='Rebuild the scene for every part (for timing comparisons)')
+  return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+  args = parse_args(sys.argv)
+
+  if args.setting != setting or args.seed is not None:
+    load_setting(args.setting, seed=args.seed)
+  if args.spec is not None:
+    with open(args.spec) as f:
+      spec = json.load(f)
+    set_sample(sample_from_spec(spec)[0], spec)
+  if args.manifest is not None:
+    manifest = load_manifest(args.manifest)
+    set_sample(manifest['matrices'], manifest['spec'])
+  if args.poses is not None:
+    set_sample(np.load(args.poses))
+  if args.no_scene_cache:
+    scene_cache = False
+  if args.resume:
+    resume = True
+  if args.preset is not None:
+    render_preset = args.preset
+  if args.compression is not None:
+    compression = args.compression
+  if args.encoding is not None:
+    image_encoding = args.encoding
+  if args.crop_size is not None:
+    crop_size = args.crop_size
+  if args.ortho_scale is not None:
+    camera_ortho_scale = args.ortho_scale
+  if args.tile_grid is not None:
+    tile_grid = tuple(int(v) for v in args.tile_grid.lower().split('x'))
+
+  if args.object is not None:
+    # Worker mode: render one (object, part, pose range) shard
+    generate_shard(args.object, args.part, args.start, args.stop, args.out)
+  else:
+    object_list = objects
+
+    for obj_atm in object_list:
+        print(f"Generating data for {obj_atm}")
+        generate_random_data(obj_atm, name="bc_data_mat")
+
+    print("Done.")
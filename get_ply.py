@@ -1,20 +1,79 @@
+"""
+Export the meshes of all FilesForKu/*_bottle.blend and *_cap.blend files in
+one Blender session.
+
+For each {name}.blend it writes meshes/{name}.ply and meshes/{name}.npz, the
+mesh centered on its bounding box center with that center and its bounding
+radius (see mesh_assets.save_centered), and builds the decimated levels of
+detail the visualizers load (mesh_assets.load_lods). Files whose outputs are
+newer than the .blend are skipped.
+
+Example:
+  blender --background --python get_ply.py -- --src FilesForKu --out meshes
+"""
+import argparse
+import glob
+import os
+import sys
+
 import bpy
-import numpy as np
 import pyvista as pv
-# from bpy.app.handlers import persistent
 
-# @persistent
-# def load_handler(dummy):
-#     print("Load Handler:", bpy.data.filepath)
+# Blender does not put the script's directory on the path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from mesh_assets import load_lods, save_centered
+
+PARTS = ('bottle', 'cap')
+
+
+def export_ply(path):
+    # The PLY exporter moved from the bundled add-on to wm in Blender 3.6
+    if bpy.app.version >= (3, 6, 0):
+        bpy.ops.wm.ply_export(filepath=path)
+    else:
+        bpy.ops.export_mesh.ply(filepath=path)
+
+
+def up_to_date(source, outputs):
+    return all(os.path.exists(p) and os.path.getmtime(p) > os.path.getmtime(source) for p in outputs)
+
+
+def export_all(src_dir, out_dir, force=False, lods=True):
+    os.makedirs(out_dir, exist_ok=True)
+    blends = sorted(p for part in PARTS for p in glob.glob(os.path.join(src_dir, f'*_{part}.blend')))
+
+    for blend in blends:
+        name = os.path.splitext(os.path.basename(blend))[0]
+        ply = os.path.join(out_dir, f'{name}.ply')
+        centered = os.path.join(out_dir, f'{name}.npz')
+
+        if not force and up_to_date(blend, [ply, centered]):
+            print(f'Skipping {blend}: up to date')
+        else:
+            print(f'Exporting {blend}')
+            # Opening a file replaces the current one in the same session
+            bpy.ops.wm.open_mainfile(filepath=blend)
+            export_ply(ply)
+            save_centered(centered, pv.read(ply))
 
-# bpy.app.handlers.load_post.append(load_handler)
+        if lods:
+            load_lods(name, ply_dir=out_dir, blend_dir=src_dir)
 
-dir = "FilesForKu/"
 
-file = "U_cube_bottle"
+def parse_args(argv):
+    # Blender passes everything after '--' through to the script
+    argv = argv[argv.index('--') + 1:] if '--' in argv else []
 
-path = dir + file + ".blend"
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--src', default='FilesForKu', help='Directory of {object}_{part}.blend files')
+    parser.add_argument('--out', default='meshes', help='Output directory')
+    parser.add_argument('--force', action='store_true', help='Re-export files that are up to date')
+    parser.add_argument('--no-lods', action='store_true', help="Don't build the level-of-detail cache")
+    return parser.parse_args(argv)
 
-bpy.ops.wm.open_mainfile(filepath=path)
 
-bpy.ops.export_mesh.ply(filepath=f"meshes/{file}.ply")
\ No newline at end of file
+if __name__ == '__main__':
+    args = parse_args(sys.argv)
+    export_all(args.src, args.out, args.force, not args.no_lods)
+    print('Done.')
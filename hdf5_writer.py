@@ -0,0 +1,373 @@
+import io
+import os
+
+import numpy as np
+from PIL import Image
+
+import h5py
+
+try:
+    # Registers the Blosc and LZ4 filters, for writing and for reading
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+IMAGE_SHAPE = (256, 256, 3)
+
+# Per-image encodings for FrameWriter(encoding=...): every frame is stored as a
+# losslessly compressed byte blob in a variable-length "images" dataset, whose
+# "encoding" and "image_shape" attributes tell readers how to decode it
+ENCODINGS = ('png', 'webp')
+
+# Compression filters for FrameWriter(compression=...) on top of h5py's own
+# 'gzip' and 'lzf'; these need the hdf5plugin package to write and to read
+PLUGIN_FILTERS = ('blosc-lz4', 'blosc-zstd', 'lz4')
+
+
+def completed_frames(group):
+    """
+    Number of frames of a component group that have actually been rendered.
+    Files written before the counter existed are complete by construction.
+    """
+    return int(group.attrs.get('n_completed', len(group['images'])))
+
+
+def image_encoding(group, key='images'):
+    """
+    The encoding of a component group's images (or crops, with key='crops'; see
+    ENCODINGS), or None if they are stored as a plain (N, H, W, 3) uint8 array.
+    """
+    return group[key].attrs.get('encoding')
+
+
+def image_shape(group, key='images'):
+    if image_encoding(group, key) is None:
+        return group[key].shape[1:]
+    return tuple(int(v) for v in group[key].attrs['image_shape'])
+
+
+def encode_image(img, encoding):
+    """
+    Losslessly compress an (H, W, 3) uint8 image into a uint8 byte array.
+    """
+    buf = io.BytesIO()
+    if encoding == 'png':
+        # Level 1 compresses almost as well as the default on mostly black frames
+        # and is several times faster to write
+        Image.fromarray(img).save(buf, format='PNG', compress_level=1)
+    elif encoding == 'webp':
+        Image.fromarray(img).save(buf, format='WEBP', lossless=True, quality=50, method=2)
+    else:
+        raise ValueError(f'Unknown image encoding {encoding!r}; expected one of {ENCODINGS}')
+    return np.frombuffer(buf.getvalue(), dtype=np.uint8)
+
+
+def decode_image(blob, out=None):
+    """
+    Decode a blob written by encode_image, into out if given.
+    """
+    with Image.open(io.BytesIO(blob.tobytes())) as img:
+        pixels = np.asarray(img.convert('RGB'))
+    if out is None:
+        return pixels
+    out[:] = pixels
+    return out
+
+
+def read_frames(group, start, stop, key='images'):
+    """
+    Images (or crops, with key='crops') [start, stop) of a component group as an
+    (n, H, W, 3) uint8 array, decoded if needed.
+    """
+    images = group[key]
+    if image_encoding(group, key) is None:
+        return images[start:stop]
+
+    out = np.empty((stop - start,) + image_shape(group, key), dtype=np.uint8)
+    for j, blob in enumerate(images[start:stop]):
+        decode_image(blob, out[j])
+    return out
+
+
+def filter_options(compression, compression_opts=None):
+    """
+    Keyword arguments for h5py's create_dataset for a compression name: None,
+    'gzip', 'lzf' or one of PLUGIN_FILTERS.
+    """
+    if compression not in PLUGIN_FILTERS:
+        return dict(compression=compression, compression_opts=compression_opts)
+
+    if hdf5plugin is None:
+        raise ImportError(f'compression={compression!r} needs the hdf5plugin package (pip install hdf5plugin)')
+    if compression == 'lz4':
+        return dict(hdf5plugin.LZ4())
+    cname = compression.split('-')[1]
+    return dict(hdf5plugin.Blosc(cname=cname, clevel=compression_opts or 5, shuffle=hdf5plugin.Blosc.SHUFFLE))
+
+
+# HDF5 filter ids of the plugin filters, and Blosc's compressor codes (its
+# seventh filter parameter)
+BLOSC_ID = 32001
+LZ4_ID = 32004
+BLOSC_COMPRESSORS = {0: 'blosclz', 1: 'lz4', 2: 'lz4hc', 3: 'snappy', 4: 'zlib', 5: 'zstd'}
+
+
+def image_compression(group, key='images'):
+    """
+    The compression filter of a component group's images (or crops): 'gzip',
+    'lzf', one of PLUGIN_FILTERS (or the name of another filter), or None.
+    h5py only names its own filters (the others are 'unknown' or None), so
+    those are read from the dataset's creation property list; that doesn't need
+    hdf5plugin.
+    """
+    images = group[key]
+    if images.compression in ('gzip', 'lzf', 'szip'):
+        return images.compression
+
+    plist = images.id.get_create_plist()
+    for i in range(plist.get_nfilters()):
+        code, _, values, name = plist.get_filter(i)
+        if code == BLOSC_ID:
+            compressor = values[6] if len(values) > 6 else 0
+            return f'blosc-{BLOSC_COMPRESSORS.get(compressor, compressor)}'
+        if code == LZ4_ID:
+            return 'lz4'
+        if code not in (h5py.h5z.FILTER_SHUFFLE, h5py.h5z.FILTER_FLETCHER32):
+            return name.decode(errors='replace') or f'filter-{code}'
+    return None
+
+
+def foreground_bbox(img, threshold=0):
+    """
+    Bounding box (y0, x0, y1, x1), end-exclusive, of the pixels of an image that
+    are brighter than threshold in any channel (the background is rendered
+    black). The whole frame if there are none.
+    """
+    mask = img.max(axis=2) > threshold
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if len(rows) == 0:
+        return (0, 0, img.shape[0], img.shape[1])
+    return (rows[0], cols[0], rows[-1] + 1, cols[-1] + 1)
+
+
+def crop_window(bbox, margin=0.1):
+    """
+    Square window (y0, x0, y1, x1) centred on a bounding box, with margin times
+    the box's longer side added on every side. It may extend past the frame.
+    """
+    y0, x0, y1, x1 = bbox
+    half = max(y1 - y0, x1 - x0) * (0.5 + margin)
+    cy, cx = (y0 + y1) / 2, (x0 + x1) / 2
+    return (cy - half, cx - half, cy + half, cx + half)
+
+
+def crop_image(img, window, size):
+    """
+    Cut a window (y0, x0, y1, x1) out of an image, padding with black where it
+    extends past the frame, and resize it to size x size (antialiased).
+    """
+    y0, x0, y1, x1 = window
+    h, w = img.shape[:2]
+    pad = int(np.ceil(max(0, -y0, -x0, y1 - h, x1 - w)))
+    if pad > 0:
+        img = np.pad(img, ((pad, pad), (pad, pad), (0, 0)))
+    box = (x0 + pad, y0 + pad, x1 + pad, y1 + pad)
+    return np.asarray(Image.fromarray(img).resize((size, size), Image.Resampling.BILINEAR, box=box))
+
+
+class FrameWriter:
+    """
+    Buffered writer for one component group (e.g. "Bottle" or "Cap") of a
+    {object}_data.hdf5 file. The "images" and "angles" datasets are preallocated
+    to n_frames, chunked one frame per chunk (the access pattern of
+    BottleCapDataset.__getitem__), and frames are written in batches of
+    batch_size instead of resizing the datasets on every frame.
+
+    The layout (group names, dataset names, shapes and dtypes) is the same as the
+    old resize-per-frame writer, so existing readers work unchanged. The number
+    of frames written so far is kept in the group's "n_completed" attribute and
+    the file is flushed with every batch, so an interrupted run can be resumed:
+    with resume=True an existing group is reopened, grown to n_frames if needed,
+    and appending continues after its completed frames.
+
+    compression applies an hdf5 filter to the datasets (see filter_options).
+    encoding='png' or 'webp' instead stores each image as a compressed blob in a
+    variable-length dataset; use read_frames (or BottleCapDataset, which decodes
+    with a thread pool) to read them back.
+
+    The foreground bounding box of every frame (see foreground_bbox) goes into a
+    "bboxes" dataset. With crop_size, a square crop around it (crop_window with
+    crop_margin) resized to crop_size x crop_size is also stored in "crops",
+    in the same way as the images, and its window in the full frame in
+    "crop_boxes". Groups written before bounding boxes existed get them
+    computed from their images when resumed.
+    """
+
+    def __init__(self, group, n_frames, batch_size=64, compression=None,
+                 compression_opts=None, image_shape=IMAGE_SHAPE, resume=False, encoding=None,
+                 crop_size=None, crop_margin=0.1):
+        self.group = group
+        self.n_frames = n_frames
+        self.batch_size = batch_size
+        self.encoding = encoding
+        self.crop_size = crop_size
+        self.crop_margin = crop_margin
+        self._filters = filter_options(compression, compression_opts)
+        # Angles and boxes are tiny so chunk them by batch
+        self._chunk = max(1, min(n_frames, batch_size))
+
+        if encoding is not None and encoding not in ENCODINGS:
+            raise ValueError(f'Unknown image encoding {encoding!r}; expected one of {ENCODINGS}')
+
+        if resume and 'images' in group:
+            self._start = completed_frames(group)
+
+            if image_encoding(group) != encoding:
+                raise ValueError(f'{group.name} stores images with encoding {image_encoding(group)!r}, '
+                                 f'not {encoding!r}')
+            if 'crops' in group:
+                stored = int(group['crops'].attrs.get('image_shape', group['crops'].shape[1:])[0])
+                if crop_size != stored:
+                    raise ValueError(f'{group.name} stores crops of size {stored}; resume with crop_size={stored}')
+
+            if n_frames < len(group['images']):
+                raise ValueError(f'{group.name} already holds {len(group["images"])} frames, '
+                                 f'more than the {n_frames} requested')
+            for name in ('images', 'angles', 'bboxes', 'crops', 'crop_boxes'):
+                if name in group:
+                    group[name].resize(n_frames, axis=0)
+        else:
+            self._start = 0
+
+        self.images = self._require_images('images', image_shape)
+        self.angles = self._require('angles', (3, 3), 'float32')
+        self.bboxes = self._require('bboxes', (4,), 'int16')
+        if crop_size is not None:
+            self.crops = self._require_images('crops', (crop_size, crop_size, 3))
+            self.crop_boxes = self._require('crop_boxes', (4,), 'float32')
+        group.attrs['n_completed'] = self._start
+
+        # Staging buffers for the current batch
+        self._images = np.zeros((batch_size,) + tuple(image_shape), dtype=np.uint8)
+        self._angles = np.zeros((batch_size, 3, 3), dtype=np.float32)
+        self._count = 0
+
+    def _require(self, name, shape, dtype):
+        if name in self.group:
+            return self.group[name]
+        dset = self.group.create_dataset(
+            name, (self.n_frames,) + shape, maxshape=(None,) + shape, dtype=dtype,
+            chunks=(self._chunk,) + shape, **self._filters)
+        if name in ('bboxes', 'crop_boxes') and self._start > 0:
+            self._backfill()
+        return dset
+
+    def _require_images(self, name, shape):
+        if name in self.group:
+            return self.group[name]
+
+        if self.encoding is None:
+            # One image per chunk
+            dset = self.group.create_dataset(
+                name, (self.n_frames,) + tuple(shape), maxshape=(None,) + tuple(shape), dtype='uint8',
+                chunks=(1,) + tuple(shape), **self._filters)
+        else:
+            # The blobs are already compressed, so no filter
+            dset = self.group.create_dataset(
+                name, (self.n_frames,), maxshape=(None,), dtype=h5py.vlen_dtype(np.uint8),
+                chunks=(self._chunk,))
+            dset.attrs['encoding'] = self.encoding
+            dset.attrs['image_shape'] = tuple(shape)
+        if name == 'crops' and self._start > 0:
+            self._backfill()
+        return dset
+
+    def _backfill(self):
+        # Compute the boxes (and crops) of the frames already in a resumed group
+        # once all the datasets they go into exist
+        if 'bboxes' not in self.group or (self.crop_size is not None and not
+                                          ('crops' in self.group and 'crop_boxes' in self.group)):
+            return
+        for start in range(0, self._start, self.batch_size):
+            stop = min(start + self.batch_size, self._start)
+            self._write_derived(start, read_frames(self.group, start, stop))
+
+    def _write_images(self, dset, start, imgs):
+        if self.encoding is None:
+            dset[start:start + len(imgs)] = imgs
+        else:
+            # One write per blob: h5py would turn equal-length blobs into a 2-D array
+            for j, img in enumerate(imgs):
+                dset[start + j] = encode_image(img, self.encoding)
+
+    def _write_derived(self, start, imgs):
+        # Bounding boxes and crops of frames [start, start + len(imgs))
+        stop = start + len(imgs)
+        bboxes = np.array([foreground_bbox(img) for img in imgs], dtype=np.int16)
+        self.group['bboxes'][start:stop] = bboxes
+        if self.crop_size is not None:
+            windows = np.array([crop_window(b, self.crop_margin) for b in bboxes], dtype=np.float32)
+            crops = np.stack([crop_image(img, w, self.crop_size) for img, w in zip(imgs, windows)])
+            self._write_images(self.group['crops'], start, crops)
+            self.group['crop_boxes'][start:stop] = windows
+
+    @property
+    def n_completed(self):
+        """Frames already written to the file."""
+        return self._start
+
+    def check_poses(self, poses):
+        """
+        Raise ValueError if the frames already in the file were rendered from
+        different poses than the first n_completed entries of poses.
+        """
+        done = self._start
+        if not np.array_equal(self.angles[:done], np.asarray(poses[:done], dtype=np.float32)):
+            raise ValueError(f'The {done} frames in {self.group.name} were rendered from a different pose set')
+
+    def append(self, img, angle):
+        if self._start + self._count >= self.n_frames:
+            raise IndexError(f'FrameWriter is full ({self.n_frames} frames)')
+
+        self._images[self._count] = img
+        self._angles[self._count] = angle
+        self._count += 1
+
+        if self._count == self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._count == 0:
+            return
+
+        stop = self._start + self._count
+        imgs = self._images[:self._count]
+        self._write_images(self.images, self._start, imgs)
+        self.angles[self._start:stop] = self._angles[:self._count]
+        self._write_derived(self._start, imgs)
+
+        # Only count frames once they are on disk
+        self.group.attrs['n_completed'] = stop
+        self.group.file.flush()
+
+        self._start = stop
+        self._count = 0
+
+    def close(self):
+        self.flush()
+
+
+def open_frame_writers(filename, n_frames, types=('Bottle', 'Cap'), resume=False, **kwargs):
+    """
+    Create an hdf5 file with one FrameWriter per component type, or with
+    resume=True reopen an existing one and continue after its completed frames.
+    Returns the open file and a dict mapping type name to writer.
+    """
+    if resume and os.path.exists(filename):
+        f = h5py.File(filename, 'a')
+        writers = {t: FrameWriter(f.require_group(t), n_frames, resume=True, **kwargs) for t in types}
+    else:
+        f = h5py.File(filename, 'w')
+        writers = {t: FrameWriter(f.create_group(t), n_frames, **kwargs) for t in types}
+    return f, writers
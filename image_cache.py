@@ -0,0 +1,121 @@
+import glob
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+import h5py
+
+from hdf5_writer import completed_frames, image_shape, read_frames
+
+
+class SharedImageStore:
+    # Images of a set of (hdf5 file, component) groups copied once into .npy files
+    # in a shared-memory directory (/dev/shm by default). Every process (e.g. each
+    # DataLoader worker) memory-maps them read-only, so all of them share one copy
+    # of the pages and reads run at memory bandwidth after the first build.
+    #
+    # Each source gets one file, named after its path and component plus a stamp
+    # of its size and modification time, so a rebuilt dataset never reuses a stale
+    # copy. Building a copy deletes the copies of older stamps of the same source,
+    # so regenerating or resuming a file replaces its copy instead of adding one.
+    # The files outlive the process so the next run starts without copying; call
+    # clear() to free the memory.
+    # Args:
+    #   sources: list of (hdf5 path, component name) pairs.
+    #   shm_dir: str, directory to put the arrays in; should be a tmpfs.
+    #   chunk: int, number of images copied per read while building.
+    #   key: str, dataset to copy, "images" or "crops".
+    def __init__(self, sources, shm_dir="/dev/shm", chunk=256, key="images"):
+        self.sources = [(os.path.abspath(path), component) for path, component in sources]
+        self.shm_dir = shm_dir
+        self.dataset_key = key
+        self.prefixes = [os.path.join(shm_dir, f"bottlecap_{self.source_id(source, key)}_") for source in self.sources]
+        self.paths = [f"{prefix}{self.stamp(source)}.npy" for prefix, source in zip(self.prefixes, self.sources)]
+        self.arrays = None
+
+        for source, prefix, path in zip(self.sources, self.prefixes, self.paths):
+            if not os.path.exists(path):
+                self.build(source, path, chunk, key)
+                # Processes still mapping an old copy keep it until they unmap it
+                for old in glob.glob(f"{prefix}*.npy"):
+                    if old != path:
+                        os.remove(old)
+
+    @staticmethod
+    def source_id(source, key="images"):
+        path, component = source
+        return hashlib.sha1(f"{path}:{component}:{key}".encode()).hexdigest()[:16]
+
+    @staticmethod
+    def stamp(source):
+        st = os.stat(source[0])
+        return hashlib.sha1(f"{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest()[:8]
+
+    @staticmethod
+    def build(source, path, chunk, key="images"):
+        path_h5, component = source
+        tmp = f"{path}.{os.getpid()}.tmp"
+
+        with h5py.File(path_h5, "r") as f:
+            group = f[component]
+            n = completed_frames(group)
+            out = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.uint8, shape=(n,) + image_shape(group, key))
+            for start in range(0, n, chunk):
+                stop = min(start + chunk, n)
+                out[start:stop] = read_frames(group, start, stop, key)
+            out.flush()
+            del out
+
+        # Publish atomically so concurrent builders never see a partial array
+        os.replace(tmp, path)
+
+    def images(self, i):
+        # Lazily map the arrays in each process
+        if self.arrays is None:
+            self.arrays = [np.load(path, mmap_mode="r") for path in self.paths]
+        return self.arrays[i]
+
+    def __getstate__(self):
+        # Workers map the files themselves instead of receiving the maps
+        state = dict(self.__dict__)
+        state["arrays"] = None
+        return state
+
+    def clear(self):
+        self.arrays = None
+        for prefix in self.prefixes:
+            for path in glob.glob(f"{prefix}*.npy"):
+                os.remove(path)
+
+
+class LRUCache:
+    # Least-recently-used cache bounded by the bytes of its values (arrays or
+    # tuples of arrays), e.g. for images of a dataset that doesn't fit in memory.
+    # Each process (DataLoader worker) keeps its own, so the total is max_bytes
+    # times the number of workers. Values must own their memory (not be views of
+    # larger arrays), or those arrays are kept alive too.
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.items = OrderedDict()
+
+    @staticmethod
+    def size(value):
+        return sum(v.nbytes for v in value) if isinstance(value, tuple) else value.nbytes
+
+    def get(self, key):
+        value = self.items.get(key)
+        if value is not None:
+            self.items.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        old = self.items.pop(key, None)
+        if old is not None:
+            self.nbytes -= self.size(old)
+        self.items[key] = value
+        self.nbytes += self.size(value)
+        while self.nbytes > self.max_bytes and self.items:
+            self.nbytes -= self.size(self.items.popitem(last=False)[1])
@@ -0,0 +1,154 @@
+"""
+Cached, decimated levels of detail (LODs) of the object meshes for the
+visualizers.
+
+get_ply.py exports the mesh of each .blend file to meshes/{name}.ply, plus
+meshes/{name}.npz with the mesh centered on its bounding box center (the
+center and bounding radius are stored too, see save_centered). From that
+centered mesh, build_lods makes progressively decimated triangle meshes
+(LOD_FRACTIONS of the faces kept) and stores them in mesh_cache/{name}.npz as
+float32 points and int32 faces, together with the sha256 of the source .blend
+(or of the PLY if there is none). load_lods reads the cache and only rebuilds
+it when the source hash changed, so the visualizers neither parse, recenter
+nor decimate the mesh on every run. The source's size and mtime are kept as
+well, so an unchanged file isn't hashed again either.
+
+pick_lod chooses the finest level whose copies for a given number of samples
+stay under a vertex budget, e.g. for uncertainty_render.add_uncertainty:
+
+  lods = load_lods('Arrow_cube_bottle')
+  add_uncertainty(plotter, pick_lod(lods, len(samples)), samples)
+"""
+import hashlib
+import os
+
+import numpy as np
+import pyvista as pv
+
+# Fraction of the faces kept at each level; level 0 is the full mesh
+LOD_FRACTIONS = (1.0, 0.25, 0.05, 0.01)
+
+# Levels aren't decimated below this many faces; they repeat the previous level
+MIN_FACES = 64
+
+# Matches uncertainty_render.add_uncertainty's budget for merged copies
+MAX_POINTS = 2_000_000
+
+# Bumped when the cache layout changes, so old caches get rebuilt
+CACHE_VERSION = 2
+
+
+def file_hash(path, block=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(block), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def source_stamp(path):
+    st = os.stat(path)
+    return np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+
+def center_mesh(mesh):
+    """
+    A triangulated copy of mesh moved so that its bounding box center is at the
+    origin, with that center and the largest distance of a vertex from it.
+    Dividing the points by that radius normalizes the mesh to the unit ball.
+    """
+    centered = mesh.triangulate().clean()
+    center = np.array(centered.center)
+    centered.points -= center
+    return centered, center, float(np.linalg.norm(centered.points, axis=1).max())
+
+
+def save_centered(path, mesh):
+    """
+    Center mesh (see center_mesh) and save it to path (.npz) as float32
+    'points', int32 'faces' (triangles), 'center' and 'scale'.
+    """
+    centered, center, scale = center_mesh(mesh)
+    with open(f'{path}.tmp', 'wb') as f:
+        np.savez(f, points=np.asarray(centered.points, dtype=np.float32),
+                 faces=centered.regular_faces.astype(np.int32), center=center, scale=scale)
+    os.replace(f'{path}.tmp', path)
+
+
+def load_centered(path):
+    with np.load(path) as f:
+        return pv.PolyData.from_regular_faces(f['points'], f['faces'])
+
+
+def build_lods(mesh, fractions=LOD_FRACTIONS):
+    """
+    The triangulated mesh followed by copies with each further fraction of its
+    faces kept (by quadric decimation), as a list of PolyData.
+    """
+    lods = [mesh.triangulate()]
+    for fraction in fractions[1:]:
+        lod = lods[0].decimate(1 - fraction)
+        lods.append(lod if lod.n_cells >= MIN_FACES else lods[-1])
+    return lods
+
+
+def save_lods(path, lods, source_hash, stamp):
+    arrays = {'version': CACHE_VERSION, 'source_hash': source_hash, 'stamp': stamp, 'levels': len(lods)}
+    for i, lod in enumerate(lods):
+        arrays[f'points_{i}'] = np.asarray(lod.points, dtype=np.float32)
+        arrays[f'faces_{i}'] = lod.regular_faces.astype(np.int32)
+
+    # Write atomically so a crash never leaves a truncated cache behind
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(f'{path}.tmp', 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(f'{path}.tmp', path)
+
+
+def read_lods(cache):
+    return [pv.PolyData.from_regular_faces(cache[f'points_{i}'], cache[f'faces_{i}'])
+            for i in range(int(cache['levels']))]
+
+
+def load_lods(name, ply_dir='meshes', blend_dir='FilesForKu', cache_dir='mesh_cache', fractions=LOD_FRACTIONS):
+    """
+    The LODs of the centered mesh {name} in ply_dir, finest first, from the
+    cache when it is up to date with {blend_dir}/{name}.blend (or with the PLY
+    when there is no .blend). The centered mesh is read from {name}.npz, or
+    from {name}.ply and centered if get_ply.py didn't write one.
+    """
+    ply = os.path.join(ply_dir, f'{name}.ply')
+    centered = os.path.join(ply_dir, f'{name}.npz')
+    blend = os.path.join(blend_dir, f'{name}.blend')
+    source = blend if os.path.exists(blend) else ply
+    path = os.path.join(cache_dir, f'{name}.npz')
+    stamp = source_stamp(source)
+
+    source_hash = None
+    if os.path.exists(path):
+        with np.load(path) as cache:
+            if int(cache['version']) == CACHE_VERSION and int(cache['levels']) == len(fractions):
+                if np.array_equal(cache['stamp'], stamp):
+                    return read_lods(cache)
+                # Touched but possibly unchanged: compare contents
+                source_hash = file_hash(source)
+                if str(cache['source_hash']) == source_hash:
+                    lods = read_lods(cache)
+                    save_lods(path, lods, source_hash, stamp)
+                    return lods
+
+    mesh = load_centered(centered) if os.path.exists(centered) else center_mesh(pv.read(ply))[0]
+    lods = build_lods(mesh, fractions)
+    save_lods(path, lods, source_hash or file_hash(source), stamp)
+    return lods
+
+
+def pick_lod(lods, n_samples, max_points=MAX_POINTS):
+    """
+    The finest of lods (finest first) with at most max_points points over
+    n_samples copies, or the coarsest one.
+    """
+    for lod in lods:
+        if n_samples * lod.n_points <= max_points:
+            return lod
+    return lods[-1]
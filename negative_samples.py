@@ -0,0 +1,146 @@
+import os
+
+import numpy as np
+import torch
+
+from scipy.spatial.transform import Rotation
+from torch.utils.data import get_worker_info
+
+from quaternions import to_matrix as quaternions_to_matrices
+
+
+# Providers of the negative (random) rotations BottleCapDataset puts next to each
+# ground-truth rotation. Every provider has sample(n, k), which returns k
+# rotation matrices for each of n images as an (n, k, 3, 3) float64 array.
+#
+#   "scipy":      Rotation.random, one call per batch (the original behaviour).
+#   "quaternion": uniform rotations from normalized 4-D Gaussians, in NumPy.
+#   "bank":       a large precomputed bank of uniform rotations; each batch takes
+#                 a random window of it under a random global rotation offset.
+#   "hopf":       an equivolumetric SO(3) grid built from the Hopf fibration,
+#                 used the same way as the bank.
+#   "deferred":   no negatives in the dataset; add them to the collated batch on
+#                 the training device with append_negatives().
+NEGATIVES = ("scipy", "quaternion", "bank", "hopf", "deferred")
+
+
+def random_quaternions(n, rng):
+    # A normalized 4-D standard normal is uniform on S3, i.e. a uniform rotation
+    q = rng.standard_normal((n, 4))
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+def random_matrices_torch(n, device=None, generator=None, dtype=torch.float32):
+    # Uniform rotation matrices (n, 3, 3) generated directly on device
+    q = torch.randn(n, 4, device=device, generator=generator, dtype=dtype)
+    q = q / q.norm(dim=1, keepdim=True)
+    w, x, y, z = q.unbind(1)
+    return torch.stack([
+        1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y),
+        2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x),
+        2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y),
+    ], dim=1).reshape(n, 3, 3)
+
+
+def append_negatives(R, neg_samples, generator=None):
+    # Add neg_samples random rotations to a collated batch of ground-truth
+    # rotations R (B, 1, 9) or (B, 9) from a dataset built with negatives="deferred",
+    # on R's device. Returns (B, neg_samples + 1, 9) like the dataset would.
+    R = R.reshape(len(R), 1, 9)
+    fake_Rs = random_matrices_torch(len(R) * neg_samples, R.device, generator, R.dtype)
+    return torch.cat([R, fake_Rs.reshape(len(R), neg_samples, 9)], dim=1)
+
+
+def hopf_grid(level):
+    # Equivolumetric grid on SO(3) from the Hopf fibration (Yershova et al., 2010):
+    # a grid on S2 for the rotation axis direction times a grid on S1 for the
+    # rotation about it. Matches the size of the HEALPix grid used by implicit-PDF
+    # (72 * 8**level rotations) with a Fibonacci sphere standing in for HEALPix.
+    n_s2 = 12 * 4 ** level
+    n_s1 = 6 * 2 ** level
+
+    i = np.arange(n_s2) + 0.5
+    theta = np.arccos(1 - 2 * i / n_s2)
+    phi = np.pi * (1 + 5 ** 0.5) * i
+    psi = (np.arange(n_s1) + 0.5) * 2 * np.pi / n_s1
+
+    theta, phi = theta[:, None], phi[:, None]
+    q = np.stack(np.broadcast_arrays(
+        np.cos(theta / 2) * np.cos(psi / 2),
+        np.cos(theta / 2) * np.sin(psi / 2),
+        np.sin(theta / 2) * np.cos(phi + psi / 2),
+        np.sin(theta / 2) * np.sin(phi + psi / 2),
+    ), axis=-1).reshape(-1, 4)
+    return quaternions_to_matrices(q)
+
+
+class NegativeSampler:
+    # Base class: keeps one random generator per process, so DataLoader workers
+    # (which are forked with a copy of the dataset) don't draw the same numbers.
+    # With a seed, worker i uses (seed, i).
+    def __init__(self, seed=None):
+        self.seed = seed
+        self._pid = None
+        self._rng = None
+
+    @property
+    def rng(self):
+        if self._pid != os.getpid():
+            if self.seed is None:
+                self._rng = np.random.default_rng()
+            else:
+                info = get_worker_info()
+                self._rng = np.random.default_rng([self.seed, 0 if info is None else info.id + 1])
+            self._pid = os.getpid()
+        return self._rng
+
+    def sample(self, n, k):
+        raise NotImplementedError
+
+
+class ScipyNegatives(NegativeSampler):
+    def sample(self, n, k):
+        return Rotation.random(n * k, random_state=self.rng).as_matrix().reshape(n, k, 3, 3)
+
+
+class QuaternionNegatives(NegativeSampler):
+    def sample(self, n, k):
+        return quaternions_to_matrices(random_quaternions(n * k, self.rng)).reshape(n, k, 3, 3)
+
+
+class PoolNegatives(NegativeSampler):
+    # Negatives taken from a precomputed pool of rotations (M, 3, 3). The pool is
+    # shuffled once; each call takes n * k consecutive entries from a random start
+    # (wrapping around) and rotates them all by one random rotation, so every
+    # batch sees a fresh, uniformly distributed set at the cost of one matrix
+    # product. With k == M every image gets the whole (rotated) pool.
+    def __init__(self, pool, seed=None):
+        super().__init__(seed)
+        order = np.random.default_rng(seed).permutation(len(pool))
+        self.pool = np.ascontiguousarray(pool[order], dtype=np.float64)
+
+    def sample(self, n, k):
+        m = n * k
+        start = self.rng.integers(len(self.pool))
+        idx = (start + np.arange(m)) % len(self.pool)
+        offset = quaternions_to_matrices(random_quaternions(1, self.rng))[0]
+        return (offset @ self.pool[idx]).reshape(n, k, 3, 3)
+
+
+def make_negative_sampler(negatives, bank_size=1 << 18, grid_level=3, seed=None):
+    # A NegativeSampler from one of the NEGATIVES names ("deferred" gives None);
+    # a NegativeSampler instance is returned as is.
+    if isinstance(negatives, NegativeSampler):
+        return negatives
+    if negatives == "scipy":
+        return ScipyNegatives(seed)
+    if negatives == "quaternion":
+        return QuaternionNegatives(seed)
+    if negatives == "bank":
+        rng = np.random.default_rng(seed)
+        return PoolNegatives(quaternions_to_matrices(random_quaternions(bank_size, rng)), seed)
+    if negatives == "hopf":
+        return PoolNegatives(hopf_grid(grid_level), seed)
+    if negatives == "deferred":
+        return None
+    raise ValueError(f"Unknown negatives {negatives!r}; expected one of {NEGATIVES} or a NegativeSampler")
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import math as m
+
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+
+from bingham_batch import BinghamBatch
+
+
+def sample_poses(H, min_angle, max_angle, symmetry=1, seed=None, z_range=(0, 2 * m.pi), y_range=None):
+    """
+    Sample H orientations with intrinsic 'XYZ' Euler angles x in
+    [min_angle, max_angle), y in y_range (the same as x if None) and z in
+    z_range, and expand each into `symmetry` copies rotated by multiples of 90
+    degrees about z.
+
+    Returns the (symmetry * H, 3, 3) rotation matrices, ordered so that copy j of
+    orientation i is at index symmetry * i + j, together with the matching
+    (symmetry * H, 3) extrinsic 'xyz' Euler angles that Blender's rotation_euler
+    expects.
+    """
+    rng = np.random.default_rng(seed)
+
+    # Randomly sample H orientations
+    x_rots = rng.uniform(min_angle, max_angle, H)
+    y_rots = rng.uniform(*(y_range if y_range is not None else (min_angle, max_angle)), H)
+    z_rots = rng.uniform(z_range[0], z_range[1], H)
+
+    # Rotate each orientation by multiples of 90 degrees about z
+    angles = np.repeat(np.stack([x_rots, y_rots, z_rots], axis=1), symmetry, axis=0)
+    angles[:, 2] += np.tile(np.arange(symmetry) * m.pi / 2, H)
+
+    rotations = R.from_euler('XYZ', angles)
+    return rotations.as_matrix(), rotations.as_euler('xyz')
+
+
+def pose_eulers(sample):
+    """
+    Extrinsic 'xyz' Euler angles for an (N, 3, 3) array of rotation matrices.
+    """
+    return R.from_matrix(sample).as_euler('xyz')
+
+
+# Pose-set specifications. A spec is a JSON-friendly dict:
+#   sampler:  'uniform-euler' (x, y, z uniform in the given ranges, intrinsic XYZ),
+#             'uniform-so3' (uniform over all rotations) or
+#             'bingham' (see bingham_batch.py; parameters under 'bingham': {'M', 'Z'})
+#   count:    number of base orientations
+#   symmetry: number of 90 degree copies about z of each base orientation
+#   seed:     random seed (None for a fresh sample)
+#   ranges:   {'x': [lo, hi], 'y': [lo, hi], 'z': [lo, hi]} for 'uniform-euler'
+DEFAULT_SPEC = {
+    'sampler': 'uniform-euler',
+    'count': 500,
+    'symmetry': 4,
+    'seed': None,
+    'ranges': {'x': [-m.pi / 3, m.pi / 3], 'y': [-m.pi / 3, m.pi / 3], 'z': [0, 2 * m.pi]},
+}
+
+SAMPLERS = ('uniform-euler', 'uniform-so3', 'bingham')
+
+
+def normalize_spec(spec):
+    """
+    Fill in defaults for a pose spec and check it.
+    """
+    out = dict(DEFAULT_SPEC)
+    out.update(spec)
+    out['ranges'] = dict(DEFAULT_SPEC['ranges'], **spec.get('ranges', {}))
+
+    if out['sampler'] not in SAMPLERS:
+        raise ValueError(f"Unknown pose sampler {out['sampler']!r}; expected one of {SAMPLERS}")
+    if out['sampler'] == 'bingham' and 'bingham' not in out:
+        raise ValueError("The 'bingham' sampler needs 'bingham': {'M': ..., 'Z': ...}")
+    return out
+
+
+def expand_symmetry(rotations, symmetry):
+    """
+    Expand scipy Rotations into `symmetry` copies each, rotated by multiples of
+    90 degrees about the body z axis; copy j of rotation i is at symmetry * i + j.
+    """
+    steps = R.from_euler('z', np.arange(symmetry)[:, None] * m.pi / 2)
+    base = R.from_quat(np.repeat(rotations.as_quat(), symmetry, axis=0))
+    return base * R.from_quat(np.tile(steps.as_quat(), (len(rotations), 1)))
+
+
+def sample_from_spec(spec):
+    """
+    Sample the pose set described by a spec. Returns the (symmetry * count, 3, 3)
+    rotation matrices and their 'xyz' Euler angles.
+    """
+    spec = normalize_spec(spec)
+    count, symmetry, seed = spec['count'], spec['symmetry'], spec['seed']
+
+    if spec['sampler'] == 'uniform-euler':
+        ranges = spec['ranges']
+        return sample_poses(count, ranges['x'][0], ranges['x'][1], symmetry, seed=seed,
+                            z_range=ranges['z'], y_range=ranges['y'])
+
+    if spec['sampler'] == 'uniform-so3':
+        rotations = R.random(count, random_state=seed)
+    else:
+        params = spec['bingham']
+        quats = BinghamBatch(np.array(params['M']), np.array(params['Z'])).random_samples(count, rng=seed)
+        # Bingham quaternions are scalar-first; scipy's are scalar-last
+        rotations = R.from_quat(quats[:, [1, 2, 3, 0]])
+
+    rotations = expand_symmetry(rotations, symmetry)
+    return rotations.as_matrix(), rotations.as_euler('xyz')
+
+
+# Pose manifests: an .npz file holding the exact matrices of a pose set, the
+# spec they were sampled from and a digest of the matrices. The digest is also
+# stored on the hdf5 groups rendered from it, so a dataset can be checked
+# against (and deduplicated by) its pose set.
+def manifest_digest(matrices):
+    return hashlib.sha256(np.ascontiguousarray(matrices, dtype=np.float64).tobytes()).hexdigest()
+
+
+def save_manifest(path, matrices, spec=None):
+    np.savez(path, matrices=np.asarray(matrices, dtype=np.float64),
+             spec=json.dumps(spec), digest=manifest_digest(matrices))
+
+
+def load_manifest(path):
+    """
+    Load a pose manifest as a dict with 'matrices', 'spec' and 'digest'.
+    """
+    with np.load(path) as data:
+        manifest = {
+            'matrices': data['matrices'],
+            'spec': json.loads(str(data['spec'])),
+            'digest': str(data['digest']),
+        }
+
+    if manifest_digest(manifest['matrices']) != manifest['digest']:
+        raise ValueError(f'Pose manifest {path} does not match its digest')
+    return manifest
+
+
+def extend_manifest(path, spec, out_path=None):
+    """
+    Append the poses sampled from spec to the pose manifest at path (in place
+    unless out_path is given). The existing poses keep their indices, so a
+    dataset rendered from the old manifest can be resumed against the new one
+    and only the added poses get rendered.
+    """
+    manifest = load_manifest(path)
+    added, _ = sample_from_spec(spec)
+
+    matrices = np.concatenate([manifest['matrices'], added])
+    save_manifest(out_path or path, matrices, {'extends': manifest['spec'], 'added': spec})
+    return load_manifest(out_path or path)
@@ -0,0 +1,118 @@
+"""
+Quaternion algebra on arrays of quaternions.
+
+Quaternions are scalar first, (w, x, y, z), as in deep_bingham and
+bingham_batch.py. Every function takes arrays of shape (..., 4) (and (..., 3)
+for vectors) and broadcasts over the leading axes, so whole sample sets are
+converted at once instead of one quaternion at a time.
+"""
+import numpy as np
+
+# Below this norm of the vector part (the sine of half the angle) axis_angle
+# returns a fixed axis instead of normalizing a vector that is mostly rounding
+# error. That covers angles near 0 and near 2 pi (q near -identity).
+SMALL_SIN = 1e-8
+
+
+def normalize(q):
+    q = np.asarray(q, dtype=np.float64)
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+
+def multiply(a, b):
+    """
+    Hamilton product a * b.
+    """
+    a0, a1, a2, a3 = np.moveaxis(np.asarray(a, dtype=np.float64), -1, 0)
+    b0, b1, b2, b3 = np.moveaxis(np.asarray(b, dtype=np.float64), -1, 0)
+    return np.stack([
+        a0 * b0 - a1 * b1 - a2 * b2 - a3 * b3,
+        a0 * b1 + a1 * b0 + a2 * b3 - a3 * b2,
+        a0 * b2 - a1 * b3 + a2 * b0 + a3 * b1,
+        a0 * b3 + a1 * b2 - a2 * b1 + a3 * b0,
+    ], axis=-1)
+
+
+def conjugate(q):
+    return np.asarray(q, dtype=np.float64) * np.array([1, -1, -1, -1])
+
+
+def rotate(v, q):
+    """
+    Rotate vectors v (..., 3) by unit quaternions q (..., 4), i.e. q v q^-1.
+    Same as to_matrix(q) @ v.
+    """
+    v = np.asarray(v, dtype=np.float64)
+    pure = np.concatenate([np.zeros(v.shape[:-1] + (1,)), v], axis=-1)
+    return multiply(multiply(q, pure), conjugate(q))[..., 1:]
+
+
+def to_matrix(q):
+    """
+    (..., 3, 3) rotation matrices of unit quaternions q (..., 4).
+    """
+    q = np.asarray(q, dtype=np.float64)
+    w, x, y, z = np.moveaxis(q, -1, 0)
+    return np.stack([
+        1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y),
+        2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x),
+        2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y),
+    ], axis=-1).reshape(q.shape[:-1] + (3, 3))
+
+
+def axis_angle(q):
+    """
+    Unit rotation axes (..., 3) and angles (...) in radians, in [0, 2 pi], of
+    unit quaternions q (..., 4). The angle comes from atan2, which stays
+    accurate near 0 and pi where arccos(w) does not; rotations by nearly 0 or
+    2 pi (q close to +-identity) get the x axis.
+    """
+    q = np.asarray(q, dtype=np.float64)
+    v = q[..., 1:]
+    sin_half = np.linalg.norm(v, axis=-1)
+    angle = 2 * np.arctan2(sin_half, q[..., 0])
+
+    small = sin_half < SMALL_SIN
+    axis = v / np.where(small, 1, sin_half)[..., None]
+    axis = np.where(small[..., None], np.array([1.0, 0.0, 0.0]), axis)
+    return axis, angle
+
+
+def slerp(q0, q1, t):
+    """
+    Spherical linear interpolation from q0 to q1 (..., 4) at t (broadcast
+    against the leading axes), along the shorter arc. Nearly identical
+    quaternions are interpolated linearly and renormalized.
+    """
+    q0 = np.asarray(q0, dtype=np.float64)
+    q1 = np.asarray(q1, dtype=np.float64)
+    t = np.asarray(t, dtype=np.float64)[..., None]
+
+    dot = np.sum(q0 * q1, axis=-1, keepdims=True)
+    # q and -q are the same rotation; flip q1 to take the shorter arc
+    q1 = np.where(dot < 0, -q1, q1)
+    dot = np.abs(dot)
+
+    theta = np.arccos(np.clip(dot, -1, 1))
+    sin_theta = np.sin(theta)
+    close = sin_theta < 1e-6
+    safe = np.where(close, 1, sin_theta)
+    w0 = np.where(close, 1 - t, np.sin((1 - t) * theta) / safe)
+    w1 = np.where(close, t, np.sin(t * theta) / safe)
+    return normalize(w0 * q0 + w1 * q1)
+
+
+def from_euler(roll, pitch, yaw):
+    """
+    Unit quaternions (..., 4) of roll (about x), pitch (about y) and yaw (about
+    z) angles in radians, applied in that order about the fixed axes.
+    """
+    cr, sr = np.cos(np.asarray(roll) / 2), np.sin(np.asarray(roll) / 2)
+    cp, sp = np.cos(np.asarray(pitch) / 2), np.sin(np.asarray(pitch) / 2)
+    cy, sy = np.cos(np.asarray(yaw) / 2), np.sin(np.asarray(yaw) / 2)
+    return np.stack(np.broadcast_arrays(
+        cr * cp * cy + sr * sp * sy,
+        sr * cp * cy - cr * sp * sy,
+        cr * sp * cy + sr * cp * sy,
+        cr * cp * sy - sr * sp * cy,
+    ), axis=-1)
@@ -0,0 +1,219 @@
+import os
+import tempfile
+
+import bpy
+import numpy as np
+from PIL import Image
+
+# The OCIO color space of each view transform of the sRGB display in Blender's
+# color management config
+VIEW_COLORSPACES = {
+    'Standard': 'sRGB',
+    'Filmic': 'Filmic sRGB',
+    'Filmic Log': 'Filmic Log',
+    'AgX': 'AgX Base sRGB',
+    'Khronos PBR Neutral': 'Khronos PBR Neutral sRGB',
+    'Raw': 'Non-Color',
+}
+
+# Largest mean difference (in 0-255 levels) between the memory and disk probe
+# frames; the two only differ by the dithering of the PNG
+PROBE_TOLERANCE = 2.0
+
+
+class RenderCapture:
+    """
+    Render the active scene and return the frame as an (height, width, 3) uint8
+    array.
+
+    mode='memory' routes the render layer through a compositor Viewer node and
+    copies its pixels straight into a preallocated buffer, so no file is written
+    or read. The Viewer node holds scene-linear pixels, so the scene's own view
+    transform (Standard, AgX, Filmic, ...) and exposure are applied in the
+    compositor in front of it, and the scene's color management is left as the
+    .blend file has it. Frames match what Blender writes to a PNG except for
+    its dithering noise. Looks and curves can't be reproduced this way and
+    raise ValueError; render those with mode='disk'. The Viewer image is
+    deleted before every render, so a frame the compositor didn't produce
+    raises RuntimeError instead of returning stale pixels, and with probe=True
+    one frame is rendered both ways when the capture is made and a mismatch
+    raises RuntimeError too.
+
+    mode='disk' is the old path, kept for debugging: every frame is written to
+    debug_path (one file per process, so parallel workers don't clobber each
+    other) and read back with PIL.
+
+    The returned array is reused by the next call to render(); copy it if it has
+    to outlive the next frame.
+    """
+
+    def __init__(self, scene, width=256, height=256, mode='memory', debug_path=None, probe=True):
+        assert mode in ('memory', 'disk')
+
+        self.scene = scene
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.debug_path = debug_path or f'render_{os.getpid()}.png'
+
+        self._pixels = np.zeros(width * height * 4, dtype=np.float32)
+        self._img = np.zeros((height, width, 3), dtype=np.uint8)
+
+        render = scene.render
+        render.resolution_x = width
+        render.resolution_y = height
+        render.resolution_percentage = 100
+
+        if self.mode == 'memory':
+            self._add_viewer_node()
+            if probe:
+                self._probe()
+        else:
+            self._set_png_output(self.debug_path)
+
+    def _set_png_output(self, path):
+        render = self.scene.render
+        render.use_overwrite = True
+        render.use_file_extension = False
+        render.image_settings.file_format = 'PNG'
+        render.image_settings.color_mode = 'RGB'
+        render.image_settings.color_depth = '8'
+        render.filepath = path
+
+    def _probe(self):
+        # Render one frame through the Viewer node and once to a PNG, and check
+        # that they agree, so a compositor that doesn't run or a view transform
+        # that isn't reproduced fails here instead of in the data
+        memory = self.render().copy()
+
+        render = self.scene.render
+        settings = render.image_settings
+        saved = (render.use_overwrite, render.use_file_extension, render.filepath,
+                 settings.file_format, settings.color_mode, settings.color_depth)
+        fd, path = tempfile.mkstemp(suffix='.png')
+        os.close(fd)
+        try:
+            self._set_png_output(path)
+            bpy.ops.render.render(write_still=True)
+            with Image.open(path) as img_pil:
+                disk = np.asarray(img_pil.convert('RGB'))
+        finally:
+            os.remove(path)
+            (render.use_overwrite, render.use_file_extension, render.filepath,
+             settings.file_format, settings.color_mode, settings.color_depth) = saved
+
+        diff = np.abs(memory.astype(np.int16) - disk).mean()
+        if diff > PROBE_TOLERANCE:
+            raise RuntimeError(f"mode='memory' frames differ from the rendered PNG by {diff:.1f} levels on "
+                               f"average; use mode='disk'")
+
+    def _add_viewer_node(self):
+        scene = self.scene
+
+        # Blender < 5.0 keeps the compositor tree on the scene; 5.0 uses a node group
+        if hasattr(scene, 'compositing_node_group'):
+            tree = scene.compositing_node_group
+            if tree is None:
+                tree = bpy.data.node_groups.new('Compositor', 'CompositorNodeTree')
+                scene.compositing_node_group = tree
+        else:
+            scene.use_nodes = True
+            tree = scene.node_tree
+        scene.render.use_compositing = True
+
+        layers = None
+        for n in tree.nodes:
+            if n.bl_idname == 'CompositorNodeRLayers':
+                layers = n
+                break
+        if layers is None:
+            layers = tree.nodes.new('CompositorNodeRLayers')
+
+        viewer = tree.nodes.new('CompositorNodeViewer')
+        tree.links.new(self._add_view_transform(tree, layers.outputs['Image']), viewer.inputs['Image'])
+        tree.nodes.active = viewer
+
+    def _add_view_transform(self, tree, socket):
+        # Apply the scene's display transform to socket with compositor nodes and
+        # return the transformed output
+        view = self.scene.view_settings
+        display = self.scene.display_settings.display_device
+        if view.look != 'None' or view.use_curve_mapping:
+            raise ValueError(f"mode='memory' can't apply the look {view.look!r} or curves of the view "
+                             f"transform; use mode='disk'")
+        if display != 'sRGB' or view.view_transform not in VIEW_COLORSPACES:
+            raise ValueError(f"mode='memory' doesn't support the {view.view_transform!r} view on a "
+                             f"{display!r} display; use mode='disk'")
+
+        if view.exposure != 0:
+            exposure = tree.nodes.new('CompositorNodeExposure')
+            exposure.inputs['Exposure'].default_value = view.exposure
+            tree.links.new(socket, exposure.inputs['Image'])
+            socket = exposure.outputs['Image']
+
+        convert = tree.nodes.new('CompositorNodeConvertColorSpace')
+        spaces = {item.identifier for item in convert.bl_rna.properties['to_color_space'].enum_items}
+        # The scene-linear space was renamed in Blender 4.0
+        convert.from_color_space = 'Linear Rec.709' if 'Linear Rec.709' in spaces else 'Linear'
+        convert.to_color_space = VIEW_COLORSPACES[view.view_transform]
+        tree.links.new(socket, convert.inputs['Image'])
+        socket = convert.outputs['Image']
+
+        if view.gamma != 1:
+            gamma = tree.nodes.new('CompositorNodeGamma')
+            gamma.inputs['Gamma'].default_value = 1 / view.gamma
+            tree.links.new(socket, gamma.inputs['Image'])
+            socket = gamma.outputs['Image']
+        return socket
+
+    def _read_viewer(self):
+        img = bpy.data.images.get('Viewer Node')
+        if img is None or tuple(img.size) != (self.width, self.height):
+            raise RuntimeError(
+                "The compositor Viewer node produced no image for this frame; this Blender "
+                "build may not run the compositor in background renders. Use mode='disk'.")
+
+        img.pixels.foreach_get(self._pixels)
+        rgba = self._pixels.reshape(self.height, self.width, 4)
+
+        # Blender images start at the bottom row; the pixels are already display
+        # encoded by the compositor, so only quantize them
+        rgb = np.clip(rgba[::-1, :, :3], 0, 1)
+        np.floor(rgb * 255 + 0.5, out=rgb)
+        self._img[:] = rgb
+        return self._img
+
+    def render_frame(self):
+        """Render the scene without reading the result back."""
+        # Several captures may share a scene (e.g. a TiledRender and the
+        # single-object capture), so set this capture's resolution (and output
+        # file) every time
+        render = self.scene.render
+        render.resolution_x = self.width
+        render.resolution_y = self.height
+
+        if self.mode == 'memory':
+            # Delete the Viewer image, so _read_viewer can tell whether this render
+            # refreshed it (selecting the node makes a placeholder of the default
+            # size, and a skipped frame would leave the previous one)
+            viewer = bpy.data.images.get('Viewer Node')
+            if viewer is not None:
+                bpy.data.images.remove(viewer)
+            bpy.ops.render.render()
+        else:
+            render.filepath = self.debug_path
+            bpy.ops.render.render(write_still=True)
+
+    def read(self):
+        """Read the last rendered frame back."""
+        if self.mode == 'memory':
+            return self._read_viewer()
+
+        # Load the image as a PIL image
+        with Image.open(self.debug_path) as img_pil:
+            self._img[:] = np.asarray(img_pil.convert('RGB'))
+        return self._img
+
+    def render(self):
+        self.render_frame()
+        return self.read()
@@ -0,0 +1,113 @@
+import bpy
+
+# Named render-quality presets for generate_synthetic_data.py. Without a preset
+# the generator renders with whatever settings each .blend file carries, so
+# throughput and quality vary from file to file; a preset pins them down.
+#   engine:    'CYCLES', 'BLENDER_EEVEE' or 'BLENDER_WORKBENCH'
+#   samples:   samples per pixel (Cycles, EEVEE) or anti-aliasing samples (Workbench)
+#   denoise:   Cycles denoising (OpenImageDenoise, CPU)
+#   bounces:   Cycles maximum light bounces
+#   tile_size: Cycles render tile size in pixels
+#   light:     Workbench lighting ('FLAT', 'STUDIO' or 'MATCAP')
+PRESETS = {
+    'fast-eevee': dict(
+        engine='BLENDER_EEVEE',
+        samples=8,
+    ),
+    'workbench-flat': dict(
+        engine='BLENDER_WORKBENCH',
+        samples=1,
+        light='FLAT',
+    ),
+    'workbench-studio': dict(
+        engine='BLENDER_WORKBENCH',
+        samples=5,
+        light='STUDIO',
+    ),
+    'cycles-cpu-lowspp': dict(
+        engine='CYCLES',
+        samples=16,
+        denoise=True,
+        bounces=2,
+        tile_size=256,
+    ),
+}
+
+
+def engine_name(engine):
+    """
+    Map 'BLENDER_EEVEE' to the identifier this Blender build uses (it is
+    'BLENDER_EEVEE_NEXT' in 4.2 - 4.x).
+    """
+    engines = bpy.types.RenderSettings.bl_rna.properties['engine'].enum_items.keys()
+    if engine == 'BLENDER_EEVEE' and engine not in engines and 'BLENDER_EEVEE_NEXT' in engines:
+        return 'BLENDER_EEVEE_NEXT'
+    return engine
+
+
+def set_samples(scene, samples):
+    engine = scene.render.engine
+    if engine == 'CYCLES':
+        scene.cycles.samples = samples
+    elif engine.startswith('BLENDER_EEVEE'):
+        scene.eevee.taa_render_samples = samples
+    elif engine == 'BLENDER_WORKBENCH':
+        scene.display.render_aa = str(samples) if samples > 1 else 'OFF'
+
+
+def apply_preset(scene, name):
+    if name not in PRESETS:
+        raise ValueError(f'Unknown render preset {name!r}; expected one of {sorted(PRESETS)}')
+    preset = PRESETS[name]
+
+    scene.render.engine = engine_name(preset['engine'])
+    set_samples(scene, preset['samples'])
+
+    if preset['engine'] == 'CYCLES':
+        cycles = scene.cycles
+        cycles.device = 'CPU'
+        cycles.use_denoising = preset.get('denoise', False)
+        if cycles.use_denoising:
+            cycles.denoiser = 'OPENIMAGEDENOISE'
+        bounces = preset.get('bounces')
+        if bounces is not None:
+            cycles.max_bounces = bounces
+            cycles.diffuse_bounces = bounces
+            cycles.glossy_bounces = bounces
+            cycles.transmission_bounces = bounces
+            cycles.transparent_max_bounces = bounces
+        tile_size = preset.get('tile_size')
+        if tile_size is not None:
+            # Blender >= 3.0 has a single tile size; older versions tile_x/tile_y
+            if hasattr(cycles, 'tile_size'):
+                cycles.tile_size = tile_size
+            else:
+                scene.render.tile_x = tile_size
+                scene.render.tile_y = tile_size
+    elif preset['engine'] == 'BLENDER_WORKBENCH':
+        scene.display.shading.light = preset.get('light', 'STUDIO')
+        scene.display.shading.color_type = 'MATERIAL'
+
+
+def describe_render_settings(scene):
+    """
+    The render settings that matter for throughput and quality, as read back
+    from the scene.
+    """
+    render = scene.render
+    info = {
+        'engine': render.engine,
+        'resolution_x': render.resolution_x,
+        'resolution_y': render.resolution_y,
+        'resolution_percentage': render.resolution_percentage,
+        'view_transform': scene.view_settings.view_transform,
+    }
+
+    if render.engine == 'CYCLES':
+        info.update(samples=scene.cycles.samples, device=scene.cycles.device,
+                    denoise=scene.cycles.use_denoising, bounces=scene.cycles.max_bounces)
+    elif render.engine.startswith('BLENDER_EEVEE'):
+        info.update(samples=scene.eevee.taa_render_samples)
+    elif render.engine == 'BLENDER_WORKBENCH':
+        info.update(samples=scene.display.render_aa, light=scene.display.shading.light)
+    return info
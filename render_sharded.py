@@ -0,0 +1,273 @@
+"""
+Render the synthetic dataset with several headless Blender processes.
+
+The pose set is sampled once and saved to a pose manifest; every worker renders a
+contiguous (object, part, pose range) shard of it into its own hdf5 file, and
+the shards are then merged into the {object}_data.hdf5 files that
+BottleCapDataset reads. Because shards are merged by pose index, the result has
+the same ordering as a serial run of generate_synthetic_data.py on the same
+poses. Objects whose existing output was already rendered from the same pose
+manifest are skipped, and outputs rendered from a pose set the manifest extends
+(see poses.extend_manifest) only get the added poses rendered and appended.
+
+Example:
+  python render_sharded.py --setting Full --workers 16 --shard-size 250
+"""
+import argparse
+import json
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import h5py
+import numpy as np
+
+from hdf5_writer import ENCODINGS, PLUGIN_FILTERS, completed_frames, image_shape, open_frame_writers, read_frames
+from poses import load_manifest, sample_from_spec, save_manifest
+from synthetic_settings import SETTINGS, setting_spec
+
+GENERATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'generate_synthetic_data.py')
+TYPES = ['Bottle', 'Cap']
+
+
+def make_jobs(objects, n_poses, shard_size, starts=None):
+    """
+    Split the work into (object, part, start, stop) shards, in serial order.
+    starts maps (object, part) to the first pose to render (default 0).
+    """
+    starts = starts or {}
+    jobs = []
+    for obj in objects:
+        for part in TYPES:
+            for start in range(starts.get((obj, part), 0), n_poses, shard_size):
+                jobs.append((obj, part, start, min(start + shard_size, n_poses)))
+    return jobs
+
+
+def shard_path(shard_dir, job):
+    obj, part, start, stop = job
+    return os.path.join(shard_dir, f'{obj}_{part}_{start:06d}_{stop:06d}.hdf5')
+
+
+def run_worker(job, args, manifest_path):
+    obj, part, start, stop = job
+    cmd = [
+        args.blender, '--background', '--threads', str(args.threads),
+        '--python', GENERATOR, '--',
+        '--setting', args.setting,
+        '--manifest', manifest_path,
+        '--object', obj, '--part', part,
+        '--start', str(start), '--stop', str(stop),
+        '--out', shard_path(args.shard_dir, job),
+    ]
+    if args.resume:
+        cmd.append('--resume')
+    if args.preset is not None:
+        cmd += ['--preset', args.preset]
+    log_path = os.path.splitext(shard_path(args.shard_dir, job))[0] + '.log'
+    with open(log_path, 'w') as log:
+        result = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+        raise RuntimeError(f'Worker for {job} failed with code {result.returncode}; see {log_path}')
+    return job
+
+
+def merge_shards(obj, jobs, shard_dir, n_poses, out_dir='.', starts=None, **writer_kwargs):
+    """
+    Merge the shards of one object into {out_dir}/{obj}_data.hdf5. With starts
+    (part -> first pose of its shards, see rendered_frames), the file already
+    holds the frames before those and the shards are appended to it.
+    """
+    starts = starts or {part: 0 for part in TYPES}
+    resume = any(starts.values())
+    # Shards are rendered at the setting's resolution, not necessarily the default
+    first = min(j for j in jobs if j[0] == obj)
+    with h5py.File(shard_path(shard_dir, first), 'r') as shard:
+        shape = image_shape(shard[first[1]])
+
+    f, writers = open_frame_writers(os.path.join(out_dir, f'{obj}_data.hdf5'), n_poses,
+                                      types=TYPES, image_shape=shape, resume=resume, **writer_kwargs)
+    pose_keys = ('pose_digest', 'pose_spec')
+    pose_attrs = {}
+
+    for part in TYPES:
+        part_jobs = sorted((j for j in jobs if j[0] == obj and j[1] == part), key=lambda j: j[2])
+
+        # Shards must tile [start, n_poses) exactly
+        expected = starts[part]
+        for job in part_jobs:
+            assert job[2] == expected, f'Missing shard for {obj} {part} at pose {expected}'
+            expected = job[3]
+        assert expected == n_poses, f'Missing shard for {obj} {part} at pose {expected}'
+
+        writer = writers[part]
+        assert writer.n_completed == starts[part], f'{obj} {part} holds {writer.n_completed} frames, not {starts[part]}'
+        # An extended pose set has a new digest; the shards carry it
+        if part_jobs:
+            for key in pose_keys:
+                if key in writer.group.attrs:
+                    del writer.group.attrs[key]
+        for job in part_jobs:
+            with h5py.File(shard_path(shard_dir, job), 'r') as shard:
+                g = shard[part]
+
+                # Carry over the pose set and render quality the shards were rendered from
+                for key in ('pose_digest', 'pose_spec', 'render_preset', 'render_settings'):
+                    if key in g.attrs:
+                        if key in writer.group.attrs and writer.group.attrs[key] != g.attrs[key]:
+                            raise ValueError(f'Shards of {obj} {part} disagree on {key}')
+                        writer.group.attrs[key] = g.attrs[key]
+                        if key in pose_keys:
+                            pose_attrs[key] = g.attrs[key]
+
+                n = len(g['angles'])
+                angles = g['angles']
+                for start in range(0, n, writer.batch_size):
+                    stop = min(start + writer.batch_size, n)
+                    for img, angle in zip(read_frames(g, start, stop), angles[start:stop]):
+                        writer.append(img, angle)
+        writer.close()
+
+    # Parts that were already complete are now part of the extended pose set too
+    for part in TYPES:
+        if not any(j[0] == obj and j[1] == part for j in jobs):
+            writers[part].group.attrs.update(pose_attrs)
+
+    f.close()
+
+
+def is_rendered(filename, digest, n_poses):
+    """
+    Whether filename already holds every part rendered from the pose set with
+    this digest.
+    """
+    if not os.path.exists(filename):
+        return False
+
+    with h5py.File(filename, 'r') as f:
+        for part in TYPES:
+            if part not in f:
+                return False
+            g = f[part]
+            if g.attrs.get('pose_digest') != digest or completed_frames(g) != n_poses:
+                return False
+    return True
+
+
+def rendered_frames(filename, matrices):
+    """
+    The number of frames of each part in filename that were rendered from the
+    first poses in matrices, so an output rendered from a shorter pose set that
+    this one extends (see poses.extend_manifest) only gets the new poses added.
+    Parts are 0 if the file doesn't exist or holds different poses.
+    """
+    counts = {part: 0 for part in TYPES}
+    if not os.path.exists(filename):
+        return counts
+
+    with h5py.File(filename, 'r') as f:
+        for part in TYPES:
+            if part not in f:
+                continue
+            g = f[part]
+            n = completed_frames(g)
+            if n > len(matrices) or not np.array_equal(g['angles'][:n], np.asarray(matrices[:n], dtype=np.float32)):
+                return {part: 0 for part in TYPES}
+            counts[part] = n
+    return counts
+
+
+def shard_done(shard_dir, job):
+    filename = shard_path(shard_dir, job)
+    if not os.path.exists(filename):
+        return False
+
+    with h5py.File(filename, 'r') as f:
+        return job[1] in f and completed_frames(f[job[1]]) == job[3] - job[2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--setting', default='Full', choices=sorted(SETTINGS))
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--threads', type=int, default=1, help='Render threads per Blender worker')
+    parser.add_argument('--shard-size', type=int, default=250, help='Poses per shard')
+    parser.add_argument('--preset', help='Render quality preset (see render_presets.py)')
+    parser.add_argument('--blender', default='blender', help='Blender executable')
+    parser.add_argument('--shard-dir', default='shards')
+    parser.add_argument('--out-dir', default='.')
+    parser.add_argument('--seed', type=int, help='Seed for the pose sample')
+    parser.add_argument('--spec', help='JSON pose spec (see poses.py) to sample the poses from')
+    parser.add_argument('--manifest', help='Existing pose manifest to render (default: sample a new one)')
+    parser.add_argument('--compression', choices=['gzip', 'lzf', *PLUGIN_FILTERS],
+                        help='Filter for the merged files (Blosc and LZ4 need hdf5plugin)')
+    parser.add_argument('--encoding', choices=ENCODINGS,
+                        help='Store the merged images as lossless PNG/WebP blobs instead of raw pixels')
+    parser.add_argument('--crop-size', type=int, help='Also store object crops resized to this size when merging')
+    parser.add_argument('--keep-shards', action='store_true')
+    parser.add_argument('--resume', action='store_true',
+                        help='Reuse the pose manifest in --shard-dir, skip finished shards and continue partial ones')
+    args = parser.parse_args()
+
+    os.makedirs(args.shard_dir, exist_ok=True)
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    # Sample the poses once so every worker renders from the same set
+    default_manifest = os.path.abspath(os.path.join(args.shard_dir, 'poses.npz'))
+    if args.manifest is not None:
+        manifest_path = os.path.abspath(args.manifest)
+    elif args.resume and os.path.exists(default_manifest):
+        manifest_path = default_manifest
+    else:
+        if args.spec is not None:
+            with open(args.spec) as f:
+                spec = json.load(f)
+        else:
+            spec = setting_spec(args.setting, seed=args.seed)
+        manifest_path = default_manifest
+        save_manifest(manifest_path, sample_from_spec(spec)[0], spec)
+    manifest = load_manifest(manifest_path)
+    n_poses = len(manifest['matrices'])
+
+    # Don't render anything that was already rendered from this pose set, and
+    # only render the added poses of outputs whose pose set this one extends
+    objects = []
+    starts = {}
+    for obj in SETTINGS[args.setting]['objects']:
+        filename = os.path.join(args.out_dir, f'{obj}_data.hdf5')
+        if is_rendered(filename, manifest['digest'], n_poses):
+            print(f'Skipping {obj}: already rendered from this pose manifest')
+            continue
+        done = rendered_frames(filename, manifest['matrices'])
+        if all(n == n_poses for n in done.values()):
+            print(f'Skipping {obj}: already rendered from these poses')
+            continue
+        if any(done.values()):
+            print(f'Extending {obj}: ' + ', '.join(f'{part} from pose {n}' for part, n in done.items()))
+        objects.append(obj)
+        starts.update({(obj, part): n for part, n in done.items()})
+
+    jobs = make_jobs(objects, n_poses, args.shard_size, starts)
+    todo = [j for j in jobs if not (args.resume and shard_done(args.shard_dir, j))]
+    print(f'Rendering {len(todo)} of {len(jobs)} shards of {n_poses} poses with {args.workers} workers')
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for i, job in enumerate(pool.map(lambda j: run_worker(j, args, manifest_path), todo)):
+            print(f'{i + 1}/{len(todo)} done: {job}')
+
+    for obj in objects:
+        print(f'Merging {obj}')
+        merge_shards(obj, jobs, args.shard_dir, n_poses, args.out_dir,
+                     starts={part: starts[obj, part] for part in TYPES}, compression=args.compression,
+                     encoding=args.encoding, crop_size=args.crop_size)
+
+        if not args.keep_shards:
+            for job in jobs:
+                if job[0] == obj:
+                    os.remove(shard_path(args.shard_dir, job))
+
+    print('Done.')
+
+
+if __name__ == '__main__':
+    main()
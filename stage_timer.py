@@ -0,0 +1,60 @@
+import os
+import subprocess
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class StageTimer:
+    """
+    Collect wall-clock durations per named stage:
+
+        timer = StageTimer()
+        with timer.stage('render'):
+            ...
+        timer.summary()
+    """
+
+    def __init__(self):
+        self.times = defaultdict(list)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name].append(time.perf_counter() - start)
+
+    def total(self, name):
+        return float(np.sum(self.times[name])) if name in self.times else 0.0
+
+    def summary(self):
+        """
+        Per-stage count, total, mean, p50 and p95 in seconds.
+        """
+        out = {}
+        for name, times in self.times.items():
+            t = np.asarray(times)
+            out[name] = {
+                'count': len(t),
+                'total': float(t.sum()),
+                'mean': float(t.mean()),
+                'p50': float(np.percentile(t, 50)),
+                'p95': float(np.percentile(t, 95)),
+            }
+        return out
+
+
+def git_commit():
+    """
+    The commit of the checkout this module is in, or None outside git, so
+    benchmark reports can be diffed between commits.
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,66 @@
+import math as m
+
+from poses import sample_from_spec
+
+# Dataset settings for generate_synthetic_data.py. These live outside the
+# generator so that tools running without Blender (e.g. render_sharded.py) can
+# build the same pose set and object list.
+ALL_OBJECTS = ['Arrow_cube', 'Circle_cube', 'Cross_cube', 'Diamond_cube', 'Hexagon_cube',
+               'Key_cube', 'Line_cube', 'Pentagon_cube', 'U_cube']
+
+SETTINGS = {
+    "Default": dict(
+        dir="FilesForKu/",
+        objects=ALL_OBJECTS,
+        MIN=-m.pi / 3,
+        MAX=m.pi / 3,
+        H=500,
+        # Number of 90 degree copies about z of each sampled orientation
+        symmetry=1,
+        randomize_color=True,
+        randomize_light=True,
+    ),
+    "Simple": dict(
+        dir="FilesForKu/",
+        objects=['Cross_cube'],
+        MIN=-m.pi / 3,
+        MAX=m.pi / 3,
+        H=500,
+        symmetry=4,
+        randomize_color=True,
+        randomize_light=True,
+    ),
+    "Full": dict(
+        dir="FilesForKu/",
+        objects=ALL_OBJECTS,
+        MIN=-m.pi / 3,
+        MAX=m.pi / 3,
+        H=500,
+        symmetry=4,
+        randomize_color=False,
+        randomize_light=False,
+    ),
+}
+
+
+def setting_spec(setting, seed=None):
+    """
+    The pose spec (see poses.py) for a setting.
+    """
+    cfg = SETTINGS[setting]
+    return {
+        'sampler': 'uniform-euler',
+        'count': cfg['H'],
+        'symmetry': cfg['symmetry'],
+        'seed': seed,
+        'ranges': {'x': [cfg['MIN'], cfg['MAX']], 'y': [cfg['MIN'], cfg['MAX']], 'z': [0, 2 * m.pi]},
+    }
+
+
+def make_sample(setting, seed=None):
+    """
+    Randomly sample the (symmetry * H, 3, 3) rotation matrices for a setting.
+    Passing a seed makes the pose set reproducible.
+    """
+    sample, _ = sample_from_spec(setting_spec(setting, seed=seed))
+    return sample
@@ -0,0 +1,41 @@
+import numpy as np
+
+from quaternions import axis_angle, to_matrix
+
+
+def test_axis_angle_identity():
+    axis, angle = axis_angle(np.array([[1.0, 0, 0, 0], [-1.0, 0, 0, 0]]))
+    assert np.all(np.isfinite(axis))
+    np.testing.assert_allclose(axis, [[1, 0, 0], [1, 0, 0]])
+    np.testing.assert_allclose(angle, [0, 2 * np.pi])
+
+
+def test_axis_angle_near_identity():
+    # Tiny rotations of both signs still give a unit axis
+    eps = 1e-12
+    q = np.array([[np.sqrt(1 - eps ** 2), 0, 0, eps], [-np.sqrt(1 - eps ** 2), 0, eps, 0]])
+    axis, _ = axis_angle(q)
+    np.testing.assert_allclose(np.linalg.norm(axis, axis=-1), 1)
+
+
+def test_axis_angle_near_pi():
+    rng = np.random.default_rng(0)
+    axes = rng.standard_normal((50, 3))
+    axes /= np.linalg.norm(axes, axis=-1, keepdims=True)
+    angles = np.pi + rng.uniform(-1e-6, 1e-6, 50)
+    q = np.concatenate([np.cos(angles / 2)[:, None], np.sin(angles / 2)[:, None] * axes], axis=-1)
+
+    axis, angle = axis_angle(q)
+    np.testing.assert_allclose(axis, axes, atol=1e-12)
+    np.testing.assert_allclose(angle, angles, atol=1e-12)
+
+
+def test_axis_angle_round_trip():
+    # q and -q give the same rotation matrix from the returned axis and angle
+    rng = np.random.default_rng(1)
+    q = rng.standard_normal((100, 4))
+    q /= np.linalg.norm(q, axis=-1, keepdims=True)
+    for sign in (1, -1):
+        axis, angle = axis_angle(sign * q)
+        back = np.concatenate([np.cos(angle / 2)[:, None], np.sin(angle / 2)[:, None] * axis], axis=-1)
+        np.testing.assert_allclose(to_matrix(back), to_matrix(q), atol=1e-12)
@@ -0,0 +1,139 @@
+import bpy
+import numpy as np
+
+from render_capture import RenderCapture
+
+
+class TiledRender:
+    """
+    Render several poses of a part in one frame. The part is instanced into a
+    rows x cols grid of linked copies (they share the mesh data), each copy gets
+    its own pose, and the camera's orthographic scale is widened by the grid
+    size so that every grid cell covers exactly what the single-object frame
+    covers. One large image is rendered and cut into per-pose tiles of
+    tile x tile pixels, which amortizes the fixed per-render overhead.
+
+    The camera has to be orthographic: a perspective camera sees every copy but
+    the centre one off-axis, which changes the tile by 10-25 intensity levels at
+    50 mm. Even so, the copies are lit from slightly different directions and,
+    with Cycles or EEVEE, by light bounced off their neighbours (3-8 levels on
+    the generator's rig); the Workbench presets match to within half a level.
+    check_framing() measures this against the single-object path and refuses
+    to continue if the tiles differ by more than a tolerance.
+    """
+
+    def __init__(self, scene, obj, rows, cols, tile=256, mode='memory'):
+        self.scene = scene
+        self.obj = obj
+        self.rows = rows
+        self.cols = cols
+        self.k = rows * cols
+        self.tile = tile
+
+        self.camera = scene.camera
+        cam = self.camera.data
+        if cam.type != 'ORTHO':
+            raise ValueError(f'Tiled rendering needs an orthographic camera, not {cam.type!r}; off-centre '
+                             f'copies would be seen off-axis')
+        self._camera_settings = (cam.sensor_fit, cam.ortho_scale)
+        self._base_location = obj.location.copy()
+
+        # Size of one frame, and the camera's image-plane axes. matrix_world is
+        # only refreshed by a depsgraph update, so poses set just before this
+        # (e.g. the camera placed by the caller) would be missed
+        bpy.context.view_layer.update()
+        cam_matrix = self.camera.matrix_world.to_3x3()
+        self._right = cam_matrix.col[0].normalized()
+        self._up = cam_matrix.col[1].normalized()
+        self.extent = cam.ortho_scale
+
+        # Linked copies of the part; the part itself is copy 0
+        self.copies = [obj]
+        for _ in range(self.k - 1):
+            copy = obj.copy()
+            scene.collection.objects.link(copy)
+            self.copies.append(copy)
+
+        self.capture = RenderCapture(scene, cols * tile, rows * tile, mode=mode)
+        self._layout_grid()
+
+    def _layout_grid(self):
+        cam = self.camera.data
+        # With HORIZONTAL fit ortho_scale spans the frame's width, i.e. cols cells
+        cam.sensor_fit = 'HORIZONTAL'
+        cam.ortho_scale = self._camera_settings[1] * self.cols
+
+        for j, copy in enumerate(self.copies):
+            r, c = divmod(j, self.cols)
+            x = (c - (self.cols - 1) / 2) * self.extent
+            y = ((self.rows - 1) / 2 - r) * self.extent
+            copy.location = self._base_location + self._right * x + self._up * y
+            copy.hide_render = False
+
+    def _layout_single(self):
+        cam = self.camera.data
+        cam.sensor_fit, cam.ortho_scale = self._camera_settings
+
+        self.obj.location = self._base_location
+        for copy in self.copies[1:]:
+            copy.hide_render = True
+
+    def set_poses(self, eulers):
+        """
+        Pose the first len(eulers) copies and hide the rest.
+        """
+        for j, copy in enumerate(self.copies):
+            if j < len(eulers):
+                copy.rotation_euler = eulers[j]
+                copy.hide_render = False
+            else:
+                copy.hide_render = True
+
+    def read(self, n):
+        """
+        Read the last render back as a list of n (tile, tile, 3) views, one per
+        posed copy.
+        """
+        img = self.capture.read()
+        t = self.tile
+        tiles = []
+        for j in range(n):
+            r, c = divmod(j, self.cols)
+            tiles.append(img[r * t:(r + 1) * t, c * t:(c + 1) * t])
+        return tiles
+
+    def check_framing(self, single_capture, eulers, tolerance=2.0):
+        """
+        Render the first k poses both one at a time (with single_capture, as the
+        single-object path does) and as one tiled frame, and compare them. Returns
+        the mean absolute difference per tile (in 0-255 intensity levels) and
+        raises ValueError if any exceeds tolerance.
+        """
+        n = min(self.k, len(eulers))
+
+        self._layout_single()
+        reference = []
+        for j in range(n):
+            self.obj.rotation_euler = eulers[j]
+            reference.append(single_capture.render().astype(np.int16))
+
+        self._layout_grid()
+        self.set_poses(eulers[:n])
+        self.capture.render_frame()
+        tiles = self.read(n)
+
+        diffs = [float(np.abs(tiles[j].astype(np.int16) - reference[j]).mean()) for j in range(n)]
+        if max(diffs) > tolerance:
+            self.restore()
+            raise ValueError(f'Tiled frames differ from single-object frames by up to {max(diffs):.2f} '
+                             f'levels (tolerance {tolerance}); use a Workbench preset or tile_grid = None')
+        return diffs
+
+    def restore(self):
+        """
+        Remove the copies and put the camera and part back as they were.
+        """
+        self._layout_single()
+        for copy in self.copies[1:]:
+            bpy.data.objects.remove(copy, do_unlink=True)
+        self.copies = [self.obj]
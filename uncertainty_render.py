@@ -0,0 +1,96 @@
+"""
+Draw a set of sampled orientations of a mesh as a single PyVista actor.
+
+Adding one rotated copy of the mesh per sample makes one actor per sample,
+which stops being interactive past a hundred or so. Here the copies are merged
+into one PolyData instead, built with one batched transform of the vertices,
+and when that would get too large (n_samples * mesh points above max_points)
+each sample is drawn as its three rotated coordinate axes, again as one
+PolyData of line segments, which stays interactive at 10k+ samples.
+
+Example:
+  plotter.subplot(1, 0)
+  add_uncertainty(plotter, mesh_bottle, sample_bottle)
+"""
+import numpy as np
+import pyvista as pv
+
+from quaternions import to_matrix
+
+STYLES = ('auto', 'mesh', 'axes')
+
+# Axis colors of the 'axes' style: x red, y green, z blue
+AXIS_COLORS = np.array([[255, 0, 0], [0, 160, 0], [0, 0, 255]], dtype=np.uint8)
+
+
+def _regular_faces(mesh):
+    # The (n_faces, k) vertex indices of a mesh, triangulating it if its faces
+    # don't all have the same number of vertices
+    faces = mesh.faces
+    k = faces[0]
+    if len(faces) % (k + 1) or np.any(faces[::k + 1] != k):
+        faces = mesh.triangulate().faces
+        k = 3
+    return faces.reshape(-1, k + 1)[:, 1:]
+
+
+def merged_copies(mesh, quats):
+    """
+    One PolyData holding a copy of mesh rotated (about the origin) by each of
+    the unit quaternions quats (n, 4), with a 'sample' cell array giving the
+    index of the copy each face belongs to.
+    """
+    R = to_matrix(quats)
+    faces = _regular_faces(mesh)
+    n, n_points = len(R), mesh.n_points
+
+    points = np.einsum('nij,pj->npi', R, mesh.points).reshape(-1, 3)
+    # Each copy's faces point at its own block of vertices
+    offset = faces[None] + (np.arange(n) * n_points)[:, None, None]
+    cells = np.concatenate([np.full(offset.shape[:2] + (1,), faces.shape[1]), offset], axis=2)
+
+    merged = pv.PolyData(points, cells.ravel())
+    # Not made the active scalars, so copies are drawn plain unless asked for
+    merged.cell_data.set_array(np.repeat(np.arange(n), len(faces)), 'sample')
+    return merged
+
+
+def axis_glyphs(quats, length=1.0, origin=(0, 0, 0)):
+    """
+    One PolyData of 3 line segments per unit quaternion in quats (n, 4): the
+    rotated x, y and z axes of the given length, starting at origin. The
+    'axis_color' cell array colors them red, green and blue.
+    """
+    R = to_matrix(quats)
+    n = len(R)
+    # Columns of R are the rotated axes
+    tips = np.asarray(origin, dtype=np.float64) + length * np.swapaxes(R, 1, 2).reshape(-1, 3)
+    points = np.concatenate([np.asarray(origin, dtype=np.float64)[None], tips])
+
+    lines = np.stack([np.full(3 * n, 2), np.zeros(3 * n, dtype=np.int64), np.arange(1, 3 * n + 1)], axis=1)
+    glyphs = pv.PolyData(points, lines=lines.ravel())
+    glyphs.cell_data['axis_color'] = np.tile(AXIS_COLORS, (n, 1))
+    return glyphs
+
+
+def add_uncertainty(plotter, mesh, quats, style='auto', max_points=2_000_000, length=None, **kwargs):
+    """
+    Add the orientations quats (n, 4) of mesh to the active subplot of plotter
+    as one actor, as merged mesh copies ('mesh') or axis glyphs ('axes').
+    'auto' picks 'mesh' while the merged mesh has at most max_points points.
+    The glyph length defaults to the mesh's bounding radius. Other keyword
+    arguments go to plotter.add_mesh. Returns the actor.
+    """
+    if style not in STYLES:
+        raise ValueError(f'Unknown style {style!r}; expected one of {STYLES}')
+    if style == 'auto':
+        style = 'mesh' if len(quats) * mesh.n_points <= max_points else 'axes'
+
+    if style == 'mesh':
+        kwargs.setdefault('show_edges', True)
+        return plotter.add_mesh(merged_copies(mesh, quats), **kwargs)
+
+    if length is None:
+        length = np.linalg.norm(mesh.points - mesh.center, axis=1).max()
+    kwargs.setdefault('line_width', 1)
+    return plotter.add_mesh(axis_glyphs(quats, length, mesh.center), scalars='axis_color', rgb=True, **kwargs)
@@ -1,6 +1,14 @@
+import os
+import sys
+
 import numpy as np
 import bpy
-from deep_bingham.bingham_distribution import BinghamDistribution
+
+# Blender does not put the script's directory on the path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bingham_batch import BinghamBatch
+from quaternions import to_matrix
 
 dir = "meshes/"
 
@@ -12,84 +20,6 @@ cap_file = dir + name + "_cap.ply"
 bottle = None
 cap = None
 
-# Perform a quaternion multiplication
-def q_mult(a,b):
-    a0,a1,a2,a3 = a
-    b0,b1,b2,b3 = b
-    
-    c0 = a0*b0 - a1*b1 - a2*b2 - a3*b3
-    c1 = a0*b1 + a1*b0 + a2*b3 - a3*b2
-    c2 = a0*b2 - a1*b3 + a2*b0 + a3*b1
-    c3 = a0*b3 + a1*b2 - a2*b1 + a3*b0
-    
-    return np.array([c0,c1,c2,c3])
-
-# Negate a quaternion
-def q_neg(a):
-    a0,a1,a2,a3 = a
-    return np.array([a0,-a1,-a2,-a3])
-
-# Rotate a vector by a quaternion
-def rotate(v, q):
-    return q_mult(q_mult(q_neg(q), v), q)
-
-def quaternion_rotation_matrix(Q):
-    """
-    Covert a quaternion into a full three-dimensional rotation matrix.
- 
-    Input
-    :param Q: A 4 element array representing the quaternion (q0,q1,q2,q3) 
- 
-    Output
-    :return: A 3x3 element matrix representing the full 3D rotation matrix. 
-             This rotation matrix converts a point in the local reference 
-             frame to a point in the global reference frame.
-    """
-    # Extract the values from Q
-    q0 = Q[0]
-    q1 = Q[1]
-    q2 = Q[2]
-    q3 = Q[3]
-     
-    # First row of the rotation matrix
-    r00 = 2 * (q0 * q0 + q1 * q1) - 1
-    r01 = 2 * (q1 * q2 - q0 * q3)
-    r02 = 2 * (q1 * q3 + q0 * q2)
-     
-    # Second row of the rotation matrix
-    r10 = 2 * (q1 * q2 + q0 * q3)
-    r11 = 2 * (q0 * q0 + q2 * q2) - 1
-    r12 = 2 * (q2 * q3 - q0 * q1)
-     
-    # Third row of the rotation matrix
-    r20 = 2 * (q1 * q3 - q0 * q2)
-    r21 = 2 * (q2 * q3 + q0 * q1)
-    r22 = 2 * (q0 * q0 + q3 * q3) - 1
-     
-    # 3x3 rotation matrix
-    rot_matrix = np.array([[r00, r01, r02],
-                           [r10, r11, r12],
-                           [r20, r21, r22]])
-                            
-    return rot_matrix
-
-def quaternion_axis_angle(q):
-    # Turn the quaternion into an axis-angle representation
-    q0 = q[0]
-    q1 = q[1]
-    q2 = q[2]
-    q3 = q[3]
-    
-    # Extract the axis
-    axis = np.array([q1,q2,q3])
-    axis = axis / np.linalg.norm(axis)
-    
-    # Extract the angle
-    angle = 2 * np.arccos(q0)
-    
-    return axis, angle
-
-
 N = 100
 
 I = np.eye(3) / 100
@@ -99,22 +29,16 @@ class BinghamObject():
         self.obj = obj
         self.M = M
         self.Z = Z
-        self.bingham = BinghamDistribution(M, Z)
+        self.bingham = BinghamBatch(M, Z)
         self.points = self.get_points()
         self.x = self.points[:,0,:] # x-coordinates
         self.y = self.points[:,1,:] # y-coordinates
         self.z = self.points[:,2,:] # z-coordinates
 
     def get_points(self):
-        points = np.zeros((N, 3, 3))
+        # Rotate the standard axes (I) by every sample quaternion at once
         sample = self.bingham.random_samples(N)
-        for i in range(N):
-            # Rotate the standard axes (I) by the sample quaternion
-            R = quaternion_rotation_matrix(sample[i])
-
-            points[i] = np.matmul(R, I)
-            
-        return points
+        return to_matrix(sample) @ I
 
 # Create a new scene
 scene = bpy.data.scenes.new("Scene")